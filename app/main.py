@@ -1,21 +1,104 @@
-from fastapi import FastAPI, status, Depends
+from fastapi import FastAPI, status, Depends, Request, Query, HTTPException
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
 import os
-import asyncio
-from functions.database import instantiate_mongodb_client
-from functions import crud
-from functions import schemas
+import json
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import time
+from contextlib import asynccontextmanager
+import functions  # noqa: F401, puts the functions/ modules on the import path, see functions/__init__.py
+from database import instantiate_mongodb_client, ensure_indexes
+import crud
+import schemas
+from cache import availability_cache
+from refresh import refresh_coordinator, read_with_revalidation, read_page_with_revalidation, stored_freshness, AvailabilitiesUnavailable
+from streaming import MAX_PAGE_SIZE, dumps, header_value, encode_page_token, decode_page_token, ndjson_lines
+from scheduler import PrewarmScheduler
+import whatsapp
+from replica import read_replica, READ_REPLICA_CHANGE_STREAM
+from resilience import circuit_breakers
+from ratelimit import rate_limiter
+from workers import parse_pool
+from metrics import metrics, start_profile, server_timing, PROFILE_HEADER, METRICS_PROFILE_ALL
 from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError
 from typing import List
 
 
-# Declare client for API calls
-client = instantiate_mongodb_client(user= os.getenv('MONGODB_USER'), password= os.getenv('MONGODB_PASSWORD'))
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create a single pooled MongoDB client when the app starts, shared by every request, and close it on shutdown.
+    The indexes of the availabilities (slot or bucket layout) and free_windows collections are created at startup if they are missing.
+    The workers answering the WhatsApp messages are started with the app.
+    When READ_REPLICA_ENABLED is set, the live availabilities are loaded into the in-process read replica.
+    When PREWARM_ENABLED is set, a background scheduler keeps the next days of every club warm.
+    """
+    async with instantiate_mongodb_client(user= os.getenv('MONGODB_USER'), password= os.getenv('MONGODB_PASSWORD')) as client:
+        await ensure_indexes(client, os.getenv('MONGODB_DB_TEST'), crud.AVAILABILITY_COLLECTIONS[crud.AVAILABILITY_LAYOUT])
+        await ensure_indexes(client, os.getenv('MONGODB_DB_TEST'), 'free_windows')
+        app.state.mongodb_client = client
+
+        if read_replica.enabled:
+            today = datetime.now(ZoneInfo("Indian/Reunion")).date()
+            await read_replica.load(crud.load_live_availabilities(client, today), today)
+            if READ_REPLICA_CHANGE_STREAM:
+                read_replica.follow(crud.get_availabilities_collection(client),
+                                    lambda since: crud.load_live_availabilities(client, since))
+
+        if not whatsapp.WHATSAPP_APP_SECRET:
+            print('WHATSAPP_APP_SECRET is not set, the webhook refuses every message')
+        app.state.dispatcher = whatsapp.MessageDispatcher(client, whatsapp.create_outbound_client())
+        app.state.dispatcher.start()
+
+        app.state.scheduler = None
+        if os.getenv('PREWARM_ENABLED', '').lower() in ('1', 'true', 'yes'):
+            app.state.scheduler = PrewarmScheduler(client)
+            await app.state.scheduler.start()
+
+        yield
+
+        if app.state.scheduler is not None:
+            await app.state.scheduler.stop()
+        await app.state.dispatcher.stop()
+        await read_replica.stop()
+        await refresh_coordinator.shutdown()
+        parse_pool.shutdown()
+
+
+def get_mongodb_client(request: Request) -> AsyncMongoClient:
+    """
+    Dependency returning the process-wide MongoDB client created in the lifespan.
+    """
+    return request.app.state.mongodb_client
+
 
 tags = [
-    {'name' : 'availabilities', 'description' : 'CRUD operations for the availabilities collection'}
+    {'name' : 'availabilities', 'description' : 'CRUD operations for the availabilities collection'},
+    {'name' : 'whatsapp', 'description' : 'Webhook of the WhatsApp chatbot'},
+    {'name' : 'monitoring', 'description' : 'Internal state of the app'}
 ]
 
-app = FastAPI(title="MongoDB database")
+app = FastAPI(title="MongoDB database", openapi_tags= tags, lifespan= lifespan)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Record the latency of every request per route and status. A request sent with the X-Profile header
+    (or every request when METRICS_PROFILE_ALL is set) gets the time spent in each stage in a Server-Timing header.
+    """
+    profile = start_profile() if METRICS_PROFILE_ALL or request.headers.get(PROFILE_HEADER) else None
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get('route')
+    metrics.observe('padel_request_seconds', elapsed, method= request.method,
+                    route= route.path if route is not None else 'unmatched', status= response.status_code)
+    if profile is not None:
+        response.headers['Server-Timing'] = server_timing(profile, elapsed)
+    return response
 
 
 # App landing page
@@ -27,28 +110,250 @@ async def read_root():
 @app.post("/availabilities/",
     response_model= None,
     status_code=status.HTTP_201_CREATED,
-    tags= tags['availabilities']
+    tags= ['availabilities']
 )
 
-async def create_availabilities(availabilities: List[schemas.AvailabilityCreate]):
+async def create_availabilities(availabilities: List[schemas.AvailabilityCreate],
+                                client: AsyncMongoClient = Depends(get_mongodb_client)):
     """
-    Insert a new set of availabilities in the MongoDB [availabilities] collection.
-    Does not insert availabilities if data in the collection is already fresh
+    Write a new set of availabilities in the MongoDB [availabilities] collection.
+    Each (club, date) present in the payload always replaces the snapshot stored for that (club, date).
     """
-    
-    crud.insert_availabilities(client, availabilities)
-    
-    
-    
-    
+
+    snapshots = {}
+    for availability in availabilities:
+        snapshots.setdefault((availability.club, availability.availability_date), []).append(availability)
+
+    return {f'{club} - {availability_date}': await crud.replace_availabilities(client, club, availability_date, snapshot)
+            for (club, availability_date), snapshot in snapshots.items()}
+
+
+
+
 
 @app.get(
     "/availabilities/",
     status_code = status.HTTP_200_OK,
+    tags= ['availabilities']
 )
-async def read_availabilities(query_filters: schemas.AvailabilityRead):
+async def read_availabilities(query_filters: schemas.AvailabilityRead,
+                              limit: int | None = Query(None, ge= 1, le= MAX_PAGE_SIZE),
+                              after: str | None = None,
+                              stream: bool = False,
+                              client: AsyncMongoClient = Depends(get_mongodb_client)):
     """
     Query a list of availabilities based on a set of filters defined by a AvailabilityRead model
+    The stored data is returned right away with its age per club. Clubs whose data is stale are
+    refreshed in the background, with at most one scrape in flight per (club, date).
+    Large results can be read without holding them in memory:
+        - with {limit}, one page sorted on (date, time, club, court, duration) is returned, along with the {after}
+          token of the next page
+        - with {stream}, every result is streamed from the cursor as NDJSON, the freshness is sent in the X-Freshness header
+    A MongoDB outage is answered with a 503, never with an empty list of availabilities.
+    """
+    try:
+        after_key = decode_page_token(after) if after else None
+    except ValueError as e:
+        raise HTTPException(status_code= status.HTTP_400_BAD_REQUEST, detail= str(e))
+
+    try:
+        if stream:
+            freshness = await stored_freshness(client, query_filters)
+            return StreamingResponse(ndjson_lines(crud.iter_availabilities(client, query_filters, after_key, limit)),
+                                     media_type= 'application/x-ndjson',
+                                     headers= {'X-Freshness': header_value(freshness)})
+
+        if limit is not None or after_key is not None:
+            page = await read_page_with_revalidation(client, query_filters, limit or MAX_PAGE_SIZE, after_key)
+            page['next'] = encode_page_token(page['next']) if page['next'] else None
+            return Response(content= dumps(page), media_type= 'application/json')
+
+        return Response(content= dumps(await read_with_revalidation(client, query_filters)), media_type= 'application/json')
+
+    except (AvailabilitiesUnavailable, PyMongoError) as e:
+        raise HTTPException(status_code= status.HTTP_503_SERVICE_UNAVAILABLE, detail= f'Availabilities are unavailable: {e}')
+
+
+@app.get(
+    "/free_windows/",
+    status_code = status.HTTP_200_OK,
+    tags= ['availabilities']
+)
+async def read_free_windows(query_filters: schemas.FreeWindowRead,
+                            longest: bool = False,
+                            client: AsyncMongoClient = Depends(get_mongodb_client)):
+    """
+    Query the maximal free windows of each court, merged from its slots when they were scraped.
+    With {longest}, only the longest window of each club is returned, e.g. the longest free window per club tonight.
+    A MongoDB outage is answered with a 503, never with an empty list of windows.
+    """
+    try:
+        windows = await crud.query_free_windows(client, query_filters, longest)
+    except PyMongoError as e:
+        raise HTTPException(status_code= status.HTTP_503_SERVICE_UNAVAILABLE, detail= f'Free windows are unavailable: {e}')
+    return Response(content= dumps({'free_windows': windows}), media_type= 'application/json')
+
+
+@app.get(
+    "/webhook/",
+    response_class= PlainTextResponse,
+    tags= ['whatsapp']
+)
+async def verify_webhook(mode: str | None = Query(None, alias= 'hub.mode'),
+                         verify_token: str | None = Query(None, alias= 'hub.verify_token'),
+                         challenge: str | None = Query(None, alias= 'hub.challenge')):
+    """
+    Subscription check of the webhook: the challenge is echoed back if the verify token matches
+    """
+    if mode != 'subscribe' or not whatsapp.WHATSAPP_VERIFY_TOKEN or verify_token != whatsapp.WHATSAPP_VERIFY_TOKEN:
+        raise HTTPException(status_code= status.HTTP_403_FORBIDDEN, detail= 'Webhook verification failed')
+    return challenge
+
+
+@app.post(
+    "/webhook/",
+    status_code = status.HTTP_200_OK,
+    tags= ['whatsapp']
+)
+async def receive_webhook(request: Request):
+    """
+    Receive the WhatsApp messages: the signature is checked, the messages are queued for the workers
+    and the call is acknowledged right away. When the queue is full, the delivery is refused with a 503
+    so that WhatsApp retries it later.
+    Every call is refused while WHATSAPP_APP_SECRET is not set, since its signature could not be checked.
+    """
+    if not whatsapp.WHATSAPP_APP_SECRET:
+        raise HTTPException(status_code= status.HTTP_403_FORBIDDEN, detail= 'Webhook signature secret is not configured')
+
+    body = await request.body()
+    if not whatsapp.verify_signature(body, request.headers.get('X-Hub-Signature-256'), whatsapp.WHATSAPP_APP_SECRET):
+        raise HTTPException(status_code= status.HTTP_403_FORBIDDEN, detail= 'Invalid signature')
+
+    try:
+        messages = whatsapp.extract_messages(json.loads(body))
+    except ValueError:
+        raise HTTPException(status_code= status.HTTP_400_BAD_REQUEST, detail= 'Invalid webhook payload')
+
+    if not request.app.state.dispatcher.submit(messages):
+        raise HTTPException(status_code= status.HTTP_503_SERVICE_UNAVAILABLE, detail= 'Work queue is full',
+                            headers= {'Retry-After': '5'})
+    return {'status': 'accepted', 'messages': len(messages)}
+
+
+@app.get(
+    "/webhook/stats/",
+    status_code = status.HTTP_200_OK,
+    tags= ['monitoring']
+)
+async def read_webhook_stats(request: Request):
+    """
+    Depth of the WhatsApp work queue, and counters of accepted, rejected, answered and failed messages
+    """
+    return request.app.state.dispatcher.stats()
+
+
+@app.get(
+    "/metrics",
+    response_class= PlainTextResponse,
+    tags= ['monitoring']
+)
+async def read_metrics(request: Request):
+    """
+    Stage and request latency histograms, scraping job counters and the state of the queues, in the Prometheus format
+    """
+    for name, value in availability_cache.stats().items():
+        if isinstance(value, (int, float)):
+            metrics.set_gauge('padel_query_cache', value, stat= name)
+    metrics.set_gauge('padel_refresh_in_flight', len(refresh_coordinator.in_flight()))
+    for name, value in request.app.state.dispatcher.stats().items():
+        if isinstance(value, (int, float)):
+            metrics.set_gauge('padel_webhook_queue', value, stat= name)
+    for club, breaker in circuit_breakers.stats().items():
+        metrics.set_gauge('padel_circuit_open', int(breaker['state'] != 'closed'), club= club)
+    return metrics.render()
+
+
+@app.get(
+    "/cache/",
+    status_code = status.HTTP_200_OK,
+    tags= ['monitoring']
+)
+async def read_cache_stats():
+    """
+    Hit and miss counters of the availability read cache
+    """
+    return availability_cache.stats()
+
+
+@app.get(
+    "/replica/",
+    status_code = status.HTTP_200_OK,
+    tags= ['monitoring']
+)
+async def read_replica_stats():
+    """
+    Content of the in-process read replica: dates covered, number of availabilities, reads and reloads
+    """
+    return read_replica.stats()
+
 
+@app.get(
+    "/refresh/",
+    status_code = status.HTTP_200_OK,
+    tags= ['monitoring']
+)
+async def read_refresh_stats():
+    """
+    Background refreshes in flight, and counters of started, coalesced and failed refreshes
+    """
+    return refresh_coordinator.stats()
+
+
+@app.get(
+    "/circuits/",
+    status_code = status.HTTP_200_OK,
+    tags= ['monitoring']
+)
+async def read_circuit_states():
+    """
+    Circuit breaker of every club scraped so far: state (closed, open or half_open) and failed jobs in a row
+    """
+    return circuit_breakers.stats()
+
+
+@app.get(
+    "/rate_limits/",
+    status_code = status.HTTP_200_OK,
+    tags= ['monitoring']
+)
+async def read_rate_limits():
+    """
+    Token bucket of every club website contacted so far: rate, burst, requests sent and time spent waiting
+    """
+    return rate_limiter.stats()
+
+
+@app.get(
+    "/parse_pool/",
+    status_code = status.HTTP_200_OK,
+    tags= ['monitoring']
+)
+async def read_parse_pool_stats():
+    """
+    Kind and size of the pool running the parse stage of the scrapers, with the batches submitted and running
+    """
+    return parse_pool.stats()
+
+
+@app.get(
+    "/scheduler/",
+    status_code = status.HTTP_200_OK,
+    tags= ['monitoring']
+)
+async def read_scheduler_state(request: Request):
+    """
+    Queue of the pre-warm scheduler: next due time of every (club, date) and budget left per club
     """
-    crud.query_availabilities(client, query_filters)
\ No newline at end of file
+    if request.app.state.scheduler is None:
+        return {'running': False}
+    return request.app.state.scheduler.snapshot()
@@ -0,0 +1,110 @@
+"""
+Benchmark of the Champ-Fleuri page parsing: BeautifulSoup (previous scraper code) against functions/extractors.py.
+
+Usage, from the repository root:
+    python benchmarks/bench_champ_fleuri_parser.py [--repeat 50] [--fixtures benchmarks/fixtures]
+
+The fixtures directory must hold champ_fleuri_login.html, champ_fleuri_dashboard.html and
+champ_fleuri_livewire_update.json. Replace them with freshly recorded pages to benchmark the live markup.
+"""
+import json
+import re
+import sys
+import timeit
+from pathlib import Path
+from bs4 import BeautifulSoup
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'functions'))
+from extractors import extract_champ_fleuri_page, extract_select_slots
+
+
+FIXTURES_PATH = Path(__file__).resolve().parent / 'fixtures'
+
+# Slot button whose handler runs another statement before selectSlot
+COMBINED_HANDLER_HTML = """<button @click="open = false; selectSlot('Padel 1', '08:00', [60,90])">08:00</button>"""
+
+
+def soup_csrf_token(html: str) -> str:
+    soup = BeautifulSoup(html, "html.parser")
+    csrf_meta = soup.find("meta", attrs={"name": "csrf-token"})
+    csrf_input = soup.find("input", {"name": "_token"})
+    return csrf_input["value"] if csrf_input else csrf_meta["content"]
+
+
+def soup_dashboard(html: str):
+    soup = BeautifulSoup(html, "html.parser")
+    csrf_meta = soup.find("meta", attrs={"name": "csrf-token"})
+    csrf_input = soup.find("input", {"name": "_token"})
+    csrf_token = csrf_input["value"] if csrf_input else csrf_meta["content"]
+
+    snapshot_length = 0
+    longest_snapshot = None
+    for element in soup.find_all("div", attrs={"wire:snapshot": True}):
+        snapshot = element["wire:snapshot"]
+        if len(snapshot) >= snapshot_length:
+            longest_snapshot = snapshot
+            snapshot_length = len(snapshot)
+
+    return csrf_token, longest_snapshot
+
+
+def soup_slots(html_string: str):
+    html = BeautifulSoup(html_string, "html.parser")
+    slots = []
+    for btn in html.find_all("button", attrs={"@click": re.compile(r"selectSlot")}):
+        match = re.search(r"selectSlot\((.*?)\)", btn.get("@click"))
+        list_to_parse = match.group(1).split(', ')
+        slots.append((list_to_parse[0].strip("'"),
+                      list_to_parse[1].strip("'"),
+                      [int(x) for x in list_to_parse[2].strip("[]").split(",")]))
+    return slots
+
+
+def bench(name: str, function, payload, repeat: int) -> float:
+    seconds = min(timeit.repeat(lambda: function(payload), number= 1, repeat= repeat))
+    print(f'  {name:<28} {seconds * 1000:8.3f} ms')
+    return seconds
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='benchmark the Champ-Fleuri page parsers')
+    parser.add_argument("--repeat", type=int, default=50, help="Number of runs per parser, the best run is reported")
+    parser.add_argument("--fixtures", type=str, default=str(FIXTURES_PATH), help="Directory of the recorded pages")
+    args = parser.parse_args()
+
+    fixtures = Path(args.fixtures)
+    login_html = (fixtures / 'champ_fleuri_login.html').read_text(encoding= 'utf-8')
+    dashboard_html = (fixtures / 'champ_fleuri_dashboard.html').read_text(encoding= 'utf-8')
+    update = json.loads((fixtures / 'champ_fleuri_livewire_update.json').read_text(encoding= 'utf-8'))
+    effects_html = update['components'][0]['effects']['html']
+
+    # Both paths must extract exactly the same data before being compared
+    assert soup_csrf_token(login_html) == extract_champ_fleuri_page(login_html).csrf_token
+    page = extract_champ_fleuri_page(dashboard_html)
+    assert soup_dashboard(dashboard_html) == (page.csrf_token, page.snapshot)
+    assert soup_slots(effects_html) == extract_select_slots(effects_html)
+    assert soup_slots(COMBINED_HANDLER_HTML) == extract_select_slots(COMBINED_HANDLER_HTML) \
+        == extract_champ_fleuri_page(COMBINED_HANDLER_HTML).slots == [('Padel 1', '08:00', [60, 90])]
+
+    cases = [
+        ('login page', soup_csrf_token, lambda html: extract_champ_fleuri_page(html).csrf_token, login_html),
+        ('dashboard page', soup_dashboard, extract_champ_fleuri_page, dashboard_html),
+        ('livewire effects.html', soup_slots, extract_select_slots, effects_html),
+    ]
+
+    total_soup = total_extractor = 0
+    for case, soup_function, extractor_function, payload in cases:
+        print(f'{case} ({len(payload) / 1024:.1f} KiB)')
+        soup_seconds = bench('BeautifulSoup html.parser', soup_function, payload, args.repeat)
+        extractor_seconds = bench('streaming extractor', extractor_function, payload, args.repeat)
+        print(f'  speed-up                     {soup_seconds / extractor_seconds:8.1f}x')
+        total_soup += soup_seconds
+        total_extractor += extractor_seconds
+
+    print(f'full scrape parsing : {total_soup * 1000:.3f} ms -> {total_extractor * 1000:.3f} ms '
+          f'({total_soup / total_extractor:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Offline end-to-end benchmark: scraping, ingest and reads, against local stand-ins of the club websites and MongoDB.
+
+Usage, from the repository root:
+    python benchmarks/bench_end_to_end.py [--days 7] [--latency_ms 50] [--jitter_ms 20] [--failure_rate 0.0]
+                                          [--mongodb_uri mongodb://localhost:27017/?replicaSet=rs0] [--reads 500]
+                                          [--no_rate_limit]
+
+The club websites are replaced by the stand-ins of benchmarks/standins.py, replaying the recorded pages of
+benchmarks/fixtures. The ingest and read phases need a local MongoDB replica set (transactions are used by
+crud.replace_availabilities), for example:
+    mongod --replSet rs0 --dbpath /tmp/padel-bench && mongosh --eval "rs.initiate()"
+Without --mongodb_uri only the scraping phase is measured. The database named by --db is dropped first.
+
+Reported figures:
+    - scraping : jobs and slots per second, with the status of every job
+    - ingest : slots per second written by replace_availabilities
+    - reads : p50 / p99 latency of GET /availabilities/, through the FastAPI app
+    - stages : count and mean duration of every span recorded by functions/metrics.py
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from standins import FIXTURES_PATH, StandinConfig, start_standin, champ_fleuri_routes, tcd_routes, oasis_routes
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_stages(metrics):
+    print('stages')
+    for name, series in sorted(metrics.histograms.items()):
+        if name != 'padel_span_seconds':
+            continue
+        for labels, histogram in sorted(series.items()):
+            label = ', '.join(f'{k}={v}' for k, v in labels)
+            print(f'  {label:<45} {histogram.count:6d} x {histogram.sum / histogram.count * 1000:9.2f} ms')
+
+
+async def bench_scraping(orchestrator, clubs, start_date, end_date, deadline):
+    start = time.perf_counter()
+    results = await orchestrator.scrape_clubs(clubs, start_date, end_date, deadline= deadline)
+    elapsed = time.perf_counter() - start
+
+    slots = sum(len(result.availabilities) for result in results)
+    statuses = {}
+    for result in results:
+        statuses[result.status] = statuses.get(result.status, 0) + 1
+    print(f'scraping : {len(results)} jobs in {elapsed:.2f} s -> {len(results) / elapsed:.2f} jobs/s, '
+          f'{slots / elapsed:.0f} slots/s, statuses {statuses}')
+    return results
+
+
+async def bench_ingest(crud, client, results):
+    written = [result for result in results if result.status == 'success']
+    slots = sum(len(result.availabilities) for result in written)
+    start = time.perf_counter()
+    for result in written:
+        await crud.replace_availabilities(client, result.club, result.availability_date, result.availabilities)
+    elapsed = time.perf_counter() - start
+    print(f'ingest : {slots} slots in {len(written)} snapshots, {elapsed:.2f} s -> {slots / elapsed:.0f} slots/s')
+
+
+async def bench_reads(clubs, dates, reads, concurrency):
+    import httpx
+    from app.main import app
+
+    filters = [{'club': [club], 'availability_date': day.isoformat()} for club in clubs for day in dates]
+    filters += [{'availability_date': day.isoformat()} for day in dates]
+    filters += [{'availability_date': day.isoformat(), 'time_from': '18:00:00', 'time_to': '21:00:00', 'min_duration': 90}
+                for day in dates]
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport= httpx.ASGITransport(app= app), base_url= 'http://bench') as client:
+            async def read():
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.request('GET', '/availabilities/', json= random.choice(filters))
+                    latencies.append(time.perf_counter() - start)
+                    response.raise_for_status()
+
+            start = time.perf_counter()
+            await asyncio.gather(*[read() for _ in range(reads)])
+            elapsed = time.perf_counter() - start
+
+    print(f'reads : {reads} requests in {elapsed:.2f} s -> {reads / elapsed:.0f} req/s, '
+          f'p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms')
+
+
+async def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='offline end-to-end benchmark of the scrapers, the ingest and the reads')
+    parser.add_argument("--days", type=int, default=7, help="Number of dates scraped per club, starting today")
+    parser.add_argument("--latency_ms", type=float, default=50, help="Mean latency of the stand-in websites")
+    parser.add_argument("--jitter_ms", type=float, default=20, help="Spread of the latency of the stand-in websites")
+    parser.add_argument("--failure_rate", type=float, default=0.0, help="Share of the stand-in requests answered with a 503")
+    parser.add_argument("--deadline", type=float, default=300, help="Time budget of the scraping phase, in seconds")
+    parser.add_argument("--mongodb_uri", type=str, default=None, help="Local MongoDB replica set used for the ingest and reads")
+    parser.add_argument("--db", type=str, default='padel_radar_bench', help="Database used by the benchmark, dropped first")
+    parser.add_argument("--reads", type=int, default=500, help="Number of read requests")
+    parser.add_argument("--read_concurrency", type=int, default=10, help="Number of read requests in flight")
+    parser.add_argument("--no_cache", action='store_true', help="Disable the read cache")
+    parser.add_argument("--no_rate_limit", action='store_true', help="Do not rate limit the requests sent to the stand-ins")
+    args = parser.parse_args()
+
+    config = StandinConfig(latency_ms= args.latency_ms, jitter_ms= args.jitter_ms, failure_rate= args.failure_rate)
+    servers = []
+    standin_hosts = {}
+    for variable, host, routes in (('CHAMP_FLEURI_BASE_URL', 'tennispadelchampfleuri.re', champ_fleuri_routes(FIXTURES_PATH)),
+                                   ('TCD_BASE_URL', 'dpr.gestion-sports.com', tcd_routes(FIXTURES_PATH)),
+                                   ('OASIS_API_URL', 'api-v3.doinsport.club', oasis_routes(FIXTURES_PATH))):
+        server, base_url = start_standin(routes, config)
+        servers.append(server)
+        os.environ[variable] = base_url
+        standin_hosts[base_url.split('://', 1)[1]] = host
+
+    # The configuration is read when the modules are imported, so it is set first
+    for variable in ('CF_USERNAME', 'CF_PASSWORD', 'TCD_USERNAME', 'TCD_PASSWORD'):
+        os.environ.setdefault(variable, 'bench')
+    os.environ['MONGODB_DB_TEST'] = args.db
+    os.environ['PREWARM_ENABLED'] = ''
+    os.environ['STALE_AFTER_MINUTES'] = str(24 * 60)
+    if args.mongodb_uri:
+        os.environ['MONGODB_URI'] = args.mongodb_uri
+    if args.no_cache:
+        os.environ['QUERY_CACHE_TTL_SECONDS'] = '0'
+
+    sys.path.append(str(ROOT_PATH))
+    sys.path.append(str(ROOT_PATH / 'functions'))
+    import orchestrator
+    import crud
+    from database import instantiate_mongodb_client, ensure_indexes
+    from metrics import metrics
+    from ratelimit import rate_limiter
+
+    # Each stand-in is rate limited like the website it replaces, unless --no_rate_limit is given
+    for standin_host, host in standin_hosts.items():
+        rate, burst = (1000.0, 1000) if args.no_rate_limit else rate_limiter.limits[host]
+        rate_limiter.configure(standin_host, rate, burst)
+
+    clubs = list(orchestrator.SCRAPERS)
+    start_date = datetime.now(ZoneInfo("Indian/Reunion")).date()
+    end_date = start_date + timedelta(days= args.days - 1)
+    dates = orchestrator.date_range(start_date, end_date)
+
+    try:
+        results = await bench_scraping(orchestrator, clubs, start_date, end_date, args.deadline)
+
+        if args.mongodb_uri:
+            async with instantiate_mongodb_client(None, None) as client:
+                await client.drop_database(args.db)
+                await ensure_indexes(client, args.db, crud.AVAILABILITY_COLLECTIONS[crud.AVAILABILITY_LAYOUT])
+                await ensure_indexes(client, args.db, 'free_windows')
+                await bench_ingest(crud, client, results)
+            await bench_reads(clubs, dates, args.reads, args.read_concurrency)
+        else:
+            print('ingest and reads skipped : no --mongodb_uri given')
+
+        print_stages(metrics)
+
+    finally:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+"""
+Local stand-ins for the club websites, replaying recorded pages with configurable latency and failure rate.
+
+Each stand-in is a stdlib ThreadingHTTPServer bound to 127.0.0.1 on a free port. Point a scraper at it with
+CHAMP_FLEURI_BASE_URL, TCD_BASE_URL or OASIS_API_URL before the scraper modules are imported.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, List, Tuple
+from urllib.parse import urlsplit
+
+
+FIXTURES_PATH = Path(__file__).resolve().parent / 'fixtures'
+
+
+@dataclass
+class StandinConfig:
+    """
+    Behaviour of a stand-in server.
+
+    Attributes:
+        - latency_ms (float): Mean time waited before answering a request
+        - jitter_ms (float): Uniform spread around the mean latency
+        - failure_rate (float): Share of the requests answered with a 503, between 0 and 1
+    """
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    failure_rate: float = 0.0
+
+
+# A route answers (status, headers, body) for a request: [(method, path prefix, handler), ...]
+Route = Tuple[str, str, Callable[['StandinHandler'], Tuple[int, dict, bytes]]]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    routes: List[Route] = []
+    config: StandinConfig = StandinConfig()
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self, method: str):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.request_body = self.rfile.read(length) if length else b''
+
+        delay = self.config.latency_ms + random.uniform(-self.config.jitter_ms, self.config.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        path = urlsplit(self.path).path
+        if random.random() < self.config.failure_rate:
+            status, headers, body = 503, {'Content-Type': 'text/plain'}, b'Service Unavailable'
+        else:
+            route = next((handler for route_method, prefix, handler in self.routes
+                          if route_method == method and path.startswith(prefix)), None)
+            if route is None:
+                status, headers, body = 404, {'Content-Type': 'text/plain'}, b'Not Found'
+            else:
+                status, headers, body = route(self)
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_standin(routes: List[Route], config: StandinConfig) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Start a stand-in server in a daemon thread.
+
+    Returns:
+        - (server, base URL) : call server.shutdown() to stop it
+    """
+    handler = type('Handler', (StandinHandler,), {'routes': routes, 'config': config})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target= server.serve_forever, daemon= True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def _text(body: str, content_type: str = 'text/html; charset=UTF-8', **headers) -> Tuple[int, dict, bytes]:
+    return 200, {'Content-Type': content_type, **headers}, body.encode('utf-8')
+
+
+def champ_fleuri_routes(fixtures: Path = FIXTURES_PATH) -> List[Route]:
+    """
+    Login page, login form, availabilities dashboard and Livewire update of Champ-Fleuri.
+    """
+    login_html = (fixtures / 'champ_fleuri_login.html').read_text(encoding= 'utf-8')
+    dashboard_html = (fixtures / 'champ_fleuri_dashboard.html').read_text(encoding= 'utf-8')
+    update_json = (fixtures / 'champ_fleuri_livewire_update.json').read_text(encoding= 'utf-8')
+    cookie = 'laravel_session=standin; Path=/'
+
+    return [
+        ('GET', '/login', lambda request: _text(login_html, **{'Set-Cookie': cookie})),
+        ('POST', '/login', lambda request: (302, {'Location': '/user/disponibilites', 'Set-Cookie': cookie}, b'')),
+        ('GET', '/user/disponibilites', lambda request: _text(dashboard_html)),
+        ('POST', '/livewire/update', lambda request: _text(update_json, 'application/json')),
+    ]
+
+
+def tcd_routes(fixtures: Path = FIXTURES_PATH) -> List[Route]:
+    """
+    Login endpoint and loadCourtDispo endpoint of TCD. Every 2h window answers the same recorded payload.
+    """
+    dispo_json = (fixtures / 'tcd_load_court_dispo.json').read_text(encoding= 'utf-8')
+    cookie = 'PHPSESSID=standin; Path=/'
+    login = lambda request: _text(json.dumps({'status': 'ok'}), 'application/json', **{'Set-Cookie': cookie})
+
+    return [
+        ('GET', '/traitement/connexion.php', login),
+        ('POST', '/traitement/connexion.php', login),
+        ('POST', '/membre/reservation.html', lambda request: _text(dispo_json, 'application/json')),
+    ]
+
+
+def oasis_routes(fixtures: Path = FIXTURES_PATH) -> List[Route]:
+    """
+    Planning endpoint of Oasis, with an ETag and 304 answers to a matching If-None-Match.
+    """
+    planning_json = (fixtures / 'oasis_planning.json').read_text(encoding= 'utf-8')
+    etag = '"' + hashlib.sha1(planning_json.encode('utf-8')).hexdigest() + '"'
+
+    def planning(request):
+        if request.headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        return _text(planning_json, 'application/json', ETag= etag)
+
+    return [('GET', '/clubs/playgrounds/plannings/', planning)]
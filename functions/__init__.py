@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The modules of this package import each other by their flat names (import schemas, from crud import ...),
+# so the package directory is put on the import path. Importing them by these same names everywhere keeps
+# a single copy of the process-wide state (read cache, refresh coordinator, metrics registry).
+FUNCTIONS_PATH = os.path.dirname(os.path.abspath(__file__))
+if FUNCTIONS_PATH not in sys.path:
+    sys.path.append(FUNCTIONS_PATH)
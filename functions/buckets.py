@@ -0,0 +1,127 @@
+from datetime import time
+from typing import Dict, List
+import schemas
+
+
+# Fields identifying a bucket: one document per (club, court, date)
+BUCKET_KEY_FIELDS = ('club', 'court', 'availability_date')
+
+# Fields shared by every slot of a bucket, stored once at the top of the document
+BUCKET_FIELDS = ('region', 'city', 'club', 'court', 'availability_date')
+
+
+def to_minutes(value: time | str) -> int:
+    """
+    Minutes since midnight of a time, or of its ISO string ('HH:MM' or 'HH:MM:SS').
+    """
+    if isinstance(value, str):
+        value = time.fromisoformat(value)
+    return value.hour * 60 + value.minute
+
+
+def from_minutes(minutes: int) -> str:
+    """
+    ISO string ('HH:MM:SS') of a number of minutes since midnight, as stored in the slot layout.
+    Minutes past the end of the day wrap around midnight.
+    """
+    return time((minutes // 60) % 24, minutes % 60).isoformat()
+
+
+def bucket_key(document: dict) -> tuple:
+    return tuple(document[field] for field in BUCKET_KEY_FIELDS)
+
+
+def to_bucket_documents(documents: List[dict]) -> List[dict]:
+    """
+    Group slot documents (see crud.to_document) into one bucket document per (club, court, date).
+    A bucket holds the shared fields once and a sorted array of [start minute, duration] pairs.
+    """
+    buckets: Dict[tuple, dict] = {}
+    for document in documents:
+        bucket = buckets.get(bucket_key(document))
+        if bucket is None:
+            bucket = {field: document[field] for field in BUCKET_FIELDS}
+            bucket.update({'scraping_datetime': document['scraping_datetime'], 'expires_at': document['expires_at'], 'slots': set()})
+            buckets[bucket_key(document)] = bucket
+
+        bucket['slots'].add((to_minutes(document['availability_time']), document['availability_duration']))
+        bucket['scraping_datetime'] = max(bucket['scraping_datetime'], document['scraping_datetime'])
+        bucket['expires_at'] = max(bucket['expires_at'], document['expires_at'])
+
+    for bucket in buckets.values():
+        bucket['slots'] = [list(slot) for slot in sorted(bucket['slots'])]
+    return list(buckets.values())
+
+
+def flatten_bucket(bucket: dict) -> List[dict]:
+    """
+    Expand a bucket document into slot documents, in the same shape as the slot layout.
+    """
+    shared = {field: bucket[field] for field in BUCKET_FIELDS}
+    shared['scraping_datetime'] = bucket['scraping_datetime']
+    if 'expires_at' in bucket:
+        shared['expires_at'] = bucket['expires_at']
+
+    return [
+        {**shared, 'availability_time': from_minutes(start), 'availability_duration': duration}
+        for start, duration in bucket['slots']
+    ]
+
+
+def slot_conditions(query_filters: schemas.AvailabilityRead) -> list:
+    """
+    Conditions on a single [start minute, duration] pair of a bucket, for the $filter stage of a bucket query.
+    """
+    conditions = []
+    if query_filters.availability_time is not None:
+        conditions.append({'$eq': [{'$arrayElemAt': ['$$slot', 0]}, to_minutes(query_filters.availability_time)]})
+    if query_filters.availability_duration is not None:
+        conditions.append({'$eq': [{'$arrayElemAt': ['$$slot', 1]}, query_filters.availability_duration]})
+    if query_filters.time_from is not None:
+        conditions.append({'$gte': [{'$arrayElemAt': ['$$slot', 0]}, to_minutes(query_filters.time_from)]})
+    if query_filters.time_to is not None:
+        conditions.append({'$lte': [{'$add': [{'$arrayElemAt': ['$$slot', 0]}, {'$arrayElemAt': ['$$slot', 1]}]},
+                                    to_minutes(query_filters.time_to)]})
+    if query_filters.min_duration is not None:
+        conditions.append({'$gte': [{'$arrayElemAt': ['$$slot', 1]}, query_filters.min_duration]})
+    return conditions
+
+
+def unwound_slot_filters(query_filters: schemas.AvailabilityRead) -> dict:
+    """
+    Filters on the start_minute and availability_duration fields of unwound bucket slots (see slot_stream_stages).
+    """
+    filters = []
+    if query_filters.availability_time is not None:
+        filters.append({'start_minute': to_minutes(query_filters.availability_time)})
+    if query_filters.availability_duration is not None:
+        filters.append({'availability_duration': query_filters.availability_duration})
+    if query_filters.time_from is not None:
+        filters.append({'start_minute': {'$gte': to_minutes(query_filters.time_from)}})
+    if query_filters.time_to is not None:
+        filters.append({'$expr': {'$lte': [{'$add': ['$start_minute', '$availability_duration']},
+                                           to_minutes(query_filters.time_to)]}})
+    if query_filters.min_duration is not None:
+        filters.append({'availability_duration': {'$gte': query_filters.min_duration}})
+    return {'$and': filters} if filters else {}
+
+
+def slot_stream_stages() -> list:
+    """
+    Aggregation stages turning matched buckets into one document per slot, with the start time kept in minutes
+    (start_minute) so that the slots can be sorted and paginated in MongoDB.
+    """
+    return [
+        {'$unwind': '$slots'},
+        {'$project': {'_id': 0, 'scraping_datetime': 1, **{field: 1 for field in BUCKET_FIELDS},
+                      'start_minute': {'$arrayElemAt': ['$slots', 0]},
+                      'availability_duration': {'$arrayElemAt': ['$slots', 1]}}},
+    ]
+
+
+def from_unwound_slot(document: dict) -> dict:
+    """
+    Slot document of the slot layout from an unwound bucket slot.
+    """
+    document['availability_time'] = from_minutes(document.pop('start_minute'))
+    return document
@@ -0,0 +1,98 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+import schemas
+
+
+# Size and lifetime of the read cache placed in front of crud.query_availabilities
+QUERY_CACHE_MAXSIZE = int(os.getenv('QUERY_CACHE_MAXSIZE', 512))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv('QUERY_CACHE_TTL_SECONDS', 300))
+
+
+class QueryCache:
+    """
+    Bounded LRU cache with a time-to-live, keyed on the normalized filters of an availability query.
+    Entries are dropped when they expire, when the cache is full (least recently used first),
+    or when new data is written for a (club, date) they may contain.
+    """
+
+    def __init__(self, maxsize: int = QUERY_CACHE_MAXSIZE, ttl: float = QUERY_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query_filters: schemas.AvailabilityRead) -> str:
+        """
+        Normalize the filters so that equivalent queries share a key: list filters are sorted and deduplicated.
+        """
+        filters = query_filters.model_dump(mode = 'json')
+        for k, v in filters.items():
+            if isinstance(v, list):
+                filters[k] = sorted(set(v))
+        return json.dumps(filters, sort_keys= True)
+
+    def get(self, query_filters: schemas.AvailabilityRead):
+        """
+        Returns the cached result of the query, or None on a miss.
+        """
+        key = self.make_key(query_filters)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, query_filters: schemas.AvailabilityRead, result):
+        key = self.make_key(query_filters)
+        self._entries[key] = (time.monotonic() + self.ttl, query_filters, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last= False)
+
+    def invalidate(self, club: str, availability_date: date) -> int:
+        """
+        Drop every cached query that may contain slots of {club} on {availability_date}.
+
+        Returns:
+            - number of entries dropped (int)
+        """
+        stale_keys = [
+            key for key, (_, query_filters, _) in self._entries.items()
+            if query_filters.availability_date == availability_date
+            and (not query_filters.club or club in query_filters.club)
+        ]
+        for key in stale_keys:
+            del self._entries[key]
+        self.invalidations += len(stale_keys)
+        return len(stale_keys)
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'invalidations': self.invalidations,
+        }
+
+
+# Process-wide cache used by crud.query_availabilities
+availability_cache = QueryCache()
@@ -1,40 +1,210 @@
-from typing import List
-from datetime import datetime
+from typing import List, Tuple
+from datetime import date, datetime, time, timedelta
 from zoneinfo import ZoneInfo
 import os
 import asyncio
 import schemas
-from pymongo import AsyncMongoClient
+from pymongo import AsyncMongoClient, UpdateOne, UpdateMany, DeleteMany, ReplaceOne
+from pymongo.asynchronous.collection import AsyncCollection
 from database import instantiate_mongodb_client
+from utilities import load_clubs
+from cache import availability_cache
+from buckets import BUCKET_KEY_FIELDS, BUCKET_FIELDS, to_bucket_documents, flatten_bucket, slot_conditions, to_minutes
+from buckets import unwound_slot_filters, slot_stream_stages, from_unwound_slot, from_minutes
+from intervals import WINDOW_FIELDS, to_window_documents
+from metrics import timed
+from replica import read_replica
 
 
+# Storage layout of the availabilities, chosen with the AVAILABILITY_LAYOUT variable:
+#   - 'slots' : one document per slot, in the availabilities collection
+#   - 'buckets' : one document per (club, court, date) holding an array of [start minute, duration] slots,
+#                 in the availability_buckets collection (see buckets.py)
+AVAILABILITY_LAYOUT = os.getenv('AVAILABILITY_LAYOUT', 'slots')
+AVAILABILITY_COLLECTIONS = {'slots': 'availabilities', 'buckets': 'availability_buckets'}
+
+
+def get_availabilities_collection(mongodb_client:AsyncMongoClient) -> AsyncCollection:
+    """
+    Returns the collection of the configured availability layout from the shared, pooled client.
+    The client is owned by the caller (FastAPI lifespan or CLI) and is never closed here.
+    """
+    return mongodb_client[os.getenv('MONGODB_DB_TEST')][AVAILABILITY_COLLECTIONS[AVAILABILITY_LAYOUT]]
+
+
+def get_free_windows_collection(mongodb_client:AsyncMongoClient) -> AsyncCollection:
+    """
+    Returns the collection of the merged free windows of each court (see intervals.py).
+    """
+    return mongodb_client[os.getenv('MONGODB_DB_TEST')].free_windows
+
+
+# Fields identifying a slot inside a (club, date) snapshot
+SLOT_KEY_FIELDS = ('club', 'court', 'availability_date', 'availability_time', 'availability_duration')
+
+
+def slot_key(document: dict) -> tuple:
+    return tuple(document[field] for field in SLOT_KEY_FIELDS)
+
+
+# Fields sent back by the reads: _id and expires_at never leave the server
+AVAILABILITY_PROJECTION = {'_id': 0, 'scraping_datetime': 1, 'region': 1, 'city': 1, 'club': 1, 'court': 1,
+                           'availability_date': 1, 'availability_time': 1, 'availability_duration': 1}
+
+# Sort order of the paginated and streamed reads, also used as their keyset.
+# The duration makes the key unique, since a club can offer several durations for the same start.
+PAGE_KEY_FIELDS = ('availability_date', 'availability_time', 'club', 'court', 'availability_duration')
+
+# Number of documents fetched per round trip by the streamed reads
+READ_BATCH_SIZE = int(os.getenv('READ_BATCH_SIZE', 500))
+
+
+def page_key(document: dict) -> dict:
+    return {field: document[field] for field in PAGE_KEY_FIELDS}
+
+
+def keyset_condition(after: dict, fields: tuple = PAGE_KEY_FIELDS) -> dict:
+    """
+    Condition matching the documents that come strictly after {after} in the order of {fields}.
+    """
+    clauses = []
+    for i, field in enumerate(fields):
+        clause = {previous: after[previous] for previous in fields[:i]}
+        clause[field] = {'$gt': after[field]}
+        clauses.append(clause)
+    return {'$or': clauses}
+
+
+# Retention windows: a slot expires {AVAILABILITY_PAST_RETENTION_HOURS} after the end of its day,
+# or {AVAILABILITY_SCRAPE_RETENTION_HOURS} after it was last scraped if no later scrape confirmed it
+AVAILABILITY_PAST_RETENTION_HOURS = float(os.getenv('AVAILABILITY_PAST_RETENTION_HOURS', 24))
+AVAILABILITY_SCRAPE_RETENTION_HOURS = float(os.getenv('AVAILABILITY_SCRAPE_RETENTION_HOURS', 72))
+
+
+def expiry_datetime(availability_date:date, scraping_datetime:datetime) -> datetime:
+    """
+    Datetime after which the TTL index removes a slot, stored as a BSON date in the expires_at field.
+    """
+    end_of_day = datetime.combine(availability_date + timedelta(days= 1), time(), tzinfo= ZoneInfo("Indian/Reunion"))
+    if scraping_datetime.tzinfo is None:
+        scraping_datetime = scraping_datetime.replace(tzinfo= ZoneInfo("Indian/Reunion"))
+    return min(end_of_day + timedelta(hours= AVAILABILITY_PAST_RETENTION_HOURS),
+               scraping_datetime + timedelta(hours= AVAILABILITY_SCRAPE_RETENTION_HOURS))
+
+
+def to_document(availability:schemas.AvailabilityCreate) -> dict:
+    """
+    MongoDB document of an availability: the JSON dump of the model, plus its start and end in minutes of day
+    and its BSON expiry date.
+    """
+    document = availability.model_dump(mode = 'json')
+    # Integer minutes of day, for the range searches (see build_mongo_query)
+    document['start_minute'] = to_minutes(availability.availability_time)
+    document['end_minute'] = document['start_minute'] + availability.availability_duration
+    document['expires_at'] = expiry_datetime(availability.availability_date, availability.scraping_datetime)
+    return document
+
+
+def build_mongo_query(filters:dict) -> dict:
+    """
+    Build a find query from a dumped filter model: empty fields are skipped, list fields become $in
+    and availability_date_before becomes a $lt on availability_date.
+    The range filters become range conditions on integer fields: time_from and time_to on start_minute and end_minute,
+    min_duration on availability_duration.
+    """
+    formatted_filters = []
+    for k, v in filters.items():
+        if v is None:
+            continue
+        if k == 'availability_date_before':
+            formatted_filters.append({'availability_date' : {'$lt' : v}})
+        elif k == 'time_from':
+            formatted_filters.append({'start_minute' : {'$gte' : to_minutes(v)}})
+        elif k == 'time_to':
+            formatted_filters.append({'end_minute' : {'$lte' : to_minutes(v)}})
+        elif k == 'min_duration':
+            formatted_filters.append({'availability_duration' : {'$gte' : v}})
+        elif isinstance(v, list):
+            formatted_filters.append({k : {'$in' : v}})
+        else:
+            formatted_filters.append({k:v})
+
+    if len(formatted_filters) == 1:
+        return formatted_filters[0]
+    return {"$and": formatted_filters}
+
+
+@timed('crud.newest_scraping_datetimes')
+async def newest_scraping_datetimes(mongodb_client:AsyncMongoClient,
+                                    clubs:List[str],
+                                    availability_dates:List[date]):
+    """
+    Newest scraping datetime of every (club, date), computed in MongoDB with a $group
+    served by the (availability_date, club, scraping_datetime) index.
+    Both layouts store these three fields at the top level, so the same pipeline reads slots or buckets.
+    
+    Returns:
+    newest scrapes (dict): {(club, availability_date) : datetime, or None if the club has no document for that date}
+    """
+    collection = get_availabilities_collection(mongodb_client)
+    days = [availability_date.isoformat() for availability_date in availability_dates]
+
+    pipeline = [
+        {'$match': {'availability_date': {'$in': days}, 'club': {'$in': clubs}}},
+        {'$group': {'_id': {'club': '$club', 'availability_date': '$availability_date'},
+                    'newest_scraping_datetime': {'$max': '$scraping_datetime'}}},
+    ]
+
+    newest_scrapes = {(club, availability_date): None for club in clubs for availability_date in availability_dates}
+    cursor = await collection.aggregate(pipeline)
+    async for group in cursor:
+        key = (group['_id']['club'], date.fromisoformat(group['_id']['availability_date']))
+        newest_scrapes[key] = datetime.fromisoformat(group['newest_scraping_datetime'])
+
+    return newest_scrapes
+
+
+def clubs_matching(query_filters:schemas.AvailabilityRead) -> List[str]:
+    """
+    Clubs targeted by a query: the clubs of the filter, or every club of collections/clubs.json
+    in the regions and cities of the filter.
+    """
+    if query_filters.club:
+        return list(query_filters.club)
+
+    return [
+        club['club'] for club in load_clubs()
+        if (not query_filters.region or club['region'] in query_filters.region)
+        and (not query_filters.city or club['city'] in query_filters.city)
+    ]
+
+
+@timed('crud.check_freshness')
 async def check_freshness(mongodb_client:AsyncMongoClient, 
-                          availabilities:List[schemas.AvailabilityRead],
+                          availabilities:schemas.AvailabilityRead,
                           minutes:int):
     """
-    Freshness is checked by first retrieving documents via a regular query.
-    Then, the oldest scraping date is checked for each club. Each club that has an oldest scraping date 
-    that is older than {minutes} returns False
+    Freshness is checked in MongoDB, by grouping the documents of the queried date by club
+    and keeping only the newest scraping date of each club.
+    Each club whose newest scraping date is older than {minutes}, or that has no document at all, returns False
     
     Returns:
     freshness (dict): {club : True/False}  
     """
     
-    query_result = await query_availabilities(mongodb_client, availabilities)
+    clubs = clubs_matching(availabilities)
+    newest_scrapes = await newest_scraping_datetimes(mongodb_client, clubs, [availabilities.availability_date])
+    now = datetime.now(ZoneInfo("Indian/Reunion"))
     freshness_dict = {}
-    oldest_scraping_datetime = datetime(2025, 1, 1, tzinfo= ZoneInfo("Indian/Reunion"))
-    for document in query_result:
-        freshness_club = document['club']
-        freshness_timestamp = freshness_dict.setdefault(freshness_club, oldest_scraping_datetime)
-        document_timestamp = datetime.fromisoformat(document['scraping_datetime'])
-        
-        if document_timestamp > freshness_timestamp:
-            freshness_dict[freshness_club] = document_timestamp
-        
-        
+
     # Check data freshness for each club
-    for club in freshness_dict:
-        delta = (datetime.now(ZoneInfo("Indian/Reunion")) - freshness_dict[club]).total_seconds() /60
+    for (club, _), newest_scraping_datetime in newest_scrapes.items():
+        if newest_scraping_datetime is None:
+            print(f'no data for {club}...')
+            freshness_dict[club] = False
+            continue
+
+        delta = (now - newest_scraping_datetime).total_seconds() /60
         if delta > minutes:
             print(f'data for {club} is not fresh enough...')
             freshness_dict[club] = False
@@ -44,100 +214,468 @@ async def check_freshness(mongodb_client:AsyncMongoClient,
     return freshness_dict
 
 
+@timed('crud.insert_availabilities')
 async def insert_availabilities(mongodb_client:AsyncMongoClient, 
                                 availabilities:List[schemas.AvailabilityCreate]):
-    async with mongodb_client as client:
-        db = client[os.getenv('MONGODB_DB_TEST')]
-        collection = db.availabilities
-    
-        try:
-            slots = [slot.model_dump(mode = 'json') for slot in availabilities]
+    collection = get_availabilities_collection(mongodb_client)
+
+    try:
+        slots = [to_document(slot) for slot in availabilities]
+        if AVAILABILITY_LAYOUT == 'buckets':
+            # Merge the slots into the existing buckets
+            operations = [
+                UpdateOne({field: bucket[field] for field in BUCKET_KEY_FIELDS},
+                          {'$set': {field: bucket[field] for field in BUCKET_FIELDS},
+                           '$max': {'scraping_datetime': bucket['scraping_datetime'], 'expires_at': bucket['expires_at']},
+                           '$addToSet': {'slots': {'$each': bucket['slots']}}},
+                          upsert= True)
+                for bucket in to_bucket_documents(slots)
+            ]
+            if operations:
+                await collection.bulk_write(operations)
+        else:
             await collection.insert_many(slots)
-            return True      
-        
-        except Exception as e:
-            print(e)
-            raise
-        
+        read_replica.add(slots)
+        for club, availability_date in {(slot.club, slot.availability_date) for slot in availabilities}:
+            availability_cache.invalidate(club, availability_date)
+            await rebuild_free_windows(mongodb_client, club, availability_date)
+        return True      
+    
+    except Exception as e:
+        print(e)
+        raise
 
-async def query_availabilities(mongodb_client:AsyncMongoClient,
-                              query_filters:schemas.AvailabilityRead):
-    async with mongodb_client as client:
-        db = client[os.getenv('MONGODB_DB_TEST')]
-        collection = db.availabilities
-        
-        # Retrieve the non-empty fields
-        mongo_filters = [{k : v} for k, v in query_filters.model_dump(mode = 'json').items() if v is not None]
+
+
+@timed('crud.replace_availabilities')
+async def replace_availabilities(mongodb_client:AsyncMongoClient,
+                                 club:str,
+                                 availability_date:date,
+                                 availabilities:List[schemas.AvailabilityCreate]):
+    """
+    Replace the snapshot of a (club, date) by a freshly scraped list of availabilities, in a single transaction.
+    Only the difference with the stored snapshot is written:
+      - new slots are upserted, keyed on (club, court, date, time, duration)
+      - slots that are no longer available (and duplicates left by append-only inserts) are deleted
+      - slots that are still available only get their scraping_datetime and expires_at moved forward
+    An empty list of availabilities removes the whole snapshot.
+    The free windows of the snapshot are rebuilt in the same transaction.
+    With the bucket layout, the same diff is applied per (club, court, date) bucket instead of per slot.
+    
+    Returns:
+    summary (dict): {'inserted' : int, 'refreshed' : int, 'deleted' : int}, counted in slots or in buckets
+    depending on the layout (the bucket layout also reports 'updated' buckets)
+    """
+    collection = get_availabilities_collection(mongodb_client)
+    snapshot_filter = {'club': club, 'availability_date': availability_date.isoformat()}
+
+    new_slots = {}
+    for slot in availabilities:
+        document = to_document(slot)
+        if (document['club'], document['availability_date']) != (club, snapshot_filter['availability_date']):
+            raise ValueError(f"Availability {document} does not belong to the snapshot {snapshot_filter}")
+        new_slots[slot_key(document)] = document
+
+    if AVAILABILITY_LAYOUT == 'buckets':
+        summary = await replace_buckets(mongodb_client, collection, snapshot_filter, list(new_slots.values()))
+        availability_cache.invalidate(club, availability_date)
+        read_replica.replace_snapshot(club, snapshot_filter['availability_date'], new_slots.values())
+        print(f'Snapshot {club} - {snapshot_filter["availability_date"]} replaced : {summary}')
+        return summary
+
+    async def apply_diff(session) -> Tuple[int, int]:
+        cursor = collection.find(snapshot_filter, projection= {field : 1 for field in SLOT_KEY_FIELDS}, session= session)
+        existing_ids = {}
+        stale_ids = []
+        for document in await cursor.to_list():
+            key = slot_key(document)
+            if key in new_slots and key not in existing_ids:
+                existing_ids[key] = document['_id']
+            else:
+                stale_ids.append(document['_id'])
+
+        operations = [
+            UpdateOne(dict(zip(SLOT_KEY_FIELDS, key)), {'$set': document}, upsert= True)
+            for key, document in new_slots.items() if key not in existing_ids
+        ]
+        if existing_ids:
+            latest = next(iter(new_slots.values()))
+            operations.append(UpdateMany({'_id': {'$in': list(existing_ids.values())}},
+                                         {'$set': {'scraping_datetime': latest['scraping_datetime'],
+                                                   'expires_at': latest['expires_at']}}))
+        if stale_ids:
+            operations.append(DeleteMany({'_id': {'$in': stale_ids}}))
+
+        if operations:
+            await collection.bulk_write(operations, ordered= True, session= session)
+
+        await write_free_windows(mongodb_client, snapshot_filter, new_slots.values(), session)
+        return len(existing_ids), len(stale_ids)
+
+    try:
+        # with_transaction retries the whole diff on TransientTransactionError (e.g. a write conflict with a concurrent
+        # replace of the same snapshot) and retries the commit on UnknownTransactionCommitResult
+        async with mongodb_client.start_session() as session:
+            refreshed, deleted = await session.with_transaction(apply_diff)
+
+        availability_cache.invalidate(club, availability_date)
+        read_replica.replace_snapshot(club, snapshot_filter['availability_date'], new_slots.values())
+
+        summary = {'inserted': len(new_slots) - refreshed, 'refreshed': refreshed, 'deleted': deleted}
+        print(f'Snapshot {club} - {snapshot_filter["availability_date"]} replaced : {summary}')
+        return summary
+
+    except Exception as e:
+        print(e)
+        raise
         
-        # reformat fields that are lists into $in
-        formatted_filters = []
-        for filter in mongo_filters:
-            for k, v in filter.items(): 
-                if isinstance(v, list):
-                    formatted_filters.append({k : {'$in' : v}})
-                else:
-                    formatted_filters.append({k:v})
-                     
-        try:
-            if len(formatted_filters) == 1:
-                final_query = formatted_filters[0]
+
+@timed('crud.write_free_windows')
+async def write_free_windows(mongodb_client:AsyncMongoClient,
+                             snapshot_filter:dict,
+                             documents,
+                             session = None) -> int:
+    """
+    Replace the free windows of a (club, date) by the windows merged from its complete snapshot of slot documents.
+
+    Returns:
+        - number of windows written (int)
+    """
+    collection = get_free_windows_collection(mongodb_client)
+    windows = to_window_documents(documents)
+    for window in windows:
+        # Slots read back through the projection have no expires_at, it is derived again from the scrape
+        window.setdefault('expires_at', expiry_datetime(date.fromisoformat(window['availability_date']),
+                                                        datetime.fromisoformat(window['scraping_datetime'])))
+    await collection.delete_many(snapshot_filter, session= session)
+    if windows:
+        await collection.insert_many(windows, session= session)
+    return len(windows)
+
+
+async def rebuild_free_windows(mongodb_client:AsyncMongoClient,
+                               club:str,
+                               availability_date:date) -> int:
+    """
+    Rebuild the free windows of a (club, date) from the slots stored for it, after slots were appended.
+    """
+    snapshot_filter = {'club': club, 'availability_date': availability_date.isoformat()}
+    query_filters = schemas.AvailabilityRead(club= [club], availability_date= availability_date)
+    documents = [document async for document in iter_availabilities(mongodb_client, query_filters)]
+    return await write_free_windows(mongodb_client, snapshot_filter, documents)
+
+
+async def replace_buckets(mongodb_client:AsyncMongoClient,
+                          collection:AsyncCollection,
+                          snapshot_filter:dict,
+                          documents:List[dict]) -> dict:
+    """
+    Bucket layout version of replace_availabilities: in a single transaction, buckets of new courts are inserted,
+    buckets whose slots changed are replaced, unchanged buckets only get their scraping_datetime and expires_at
+    moved forward, and buckets of courts that are no longer available are deleted.
+    """
+    new_buckets = {bucket['court']: bucket for bucket in to_bucket_documents(documents)}
+
+    async def apply_diff(session) -> Tuple[set, int, list, list]:
+        cursor = collection.find(snapshot_filter, projection= {'court': 1, 'slots': 1}, session= session)
+        seen_courts = set()
+        unchanged_ids = []
+        stale_ids = []
+        operations = []
+        for document in await cursor.to_list():
+            bucket = new_buckets.get(document['court'])
+            if bucket is None or document['court'] in seen_courts:
+                stale_ids.append(document['_id'])
+            elif document['slots'] == bucket['slots']:
+                unchanged_ids.append(document['_id'])
             else:
-                final_query = {"$and": formatted_filters}
-            
-            cursor = collection.find(final_query)
+                operations.append(ReplaceOne({'_id': document['_id']}, bucket))
+            seen_courts.add(document['court'])
+
+        updated = len(operations)
+        operations.extend(
+            UpdateOne({field: bucket[field] for field in BUCKET_KEY_FIELDS}, {'$set': bucket}, upsert= True)
+            for court, bucket in new_buckets.items() if court not in seen_courts
+        )
+        if unchanged_ids:
+            latest = next(iter(new_buckets.values()))
+            operations.append(UpdateMany({'_id': {'$in': unchanged_ids}},
+                                         {'$set': {'scraping_datetime': latest['scraping_datetime'],
+                                                   'expires_at': latest['expires_at']}}))
+        if stale_ids:
+            operations.append(DeleteMany({'_id': {'$in': stale_ids}}))
+
+        if operations:
+            await collection.bulk_write(operations, ordered= True, session= session)
+
+        await write_free_windows(mongodb_client, snapshot_filter, documents, session)
+        return seen_courts, updated, unchanged_ids, stale_ids
+
+    # with_transaction retries the diff on transient errors, see replace_availabilities
+    async with mongodb_client.start_session() as session:
+        seen_courts, updated, unchanged_ids, stale_ids = await session.with_transaction(apply_diff)
+
+    return {'inserted': len(new_buckets) - len(seen_courts & new_buckets.keys()), 'updated': updated,
+            'refreshed': len(unchanged_ids), 'deleted': len(stale_ids)}
+
+
+async def find_buckets(collection:AsyncCollection,
+                       query_filters:schemas.AvailabilityRead) -> List[dict]:
+    """
+    Bucket layout version of the availability query: buckets are matched on their shared fields,
+    the time and duration filters are applied to the slot arrays in MongoDB with $filter,
+    and the remaining slots are expanded into documents shaped like the slot layout.
+    """
+    bucket_filters = query_filters.model_dump(mode = 'json', include= set(BUCKET_FIELDS))
+    pipeline = [{'$match': build_mongo_query(bucket_filters)}]
+
+    conditions = slot_conditions(query_filters)
+    if conditions:
+        pipeline.append({'$set': {'slots': {'$filter': {'input': '$slots', 'as': 'slot', 'cond': {'$and': conditions}}}}})
+        pipeline.append({'$match': {'slots.0': {'$exists': True}}})
+
+    pipeline.append({'$project': {'_id': 0, 'expires_at': 0}})
+
+    cursor = await collection.aggregate(pipeline)
+    return [slot for bucket in await cursor.to_list() for slot in flatten_bucket(bucket)]
+
+
+async def iter_availabilities(mongodb_client:AsyncMongoClient,
+                              query_filters:schemas.AvailabilityRead,
+                              after:dict | None = None,
+                              limit:int | None = None):
+    """
+    Stream the availabilities matching a AvailabilityRead model straight from the cursor, in the order of PAGE_KEY_FIELDS,
+    with only the fields of AVAILABILITY_PROJECTION. Documents are fetched {READ_BATCH_SIZE} at a time,
+    so memory does not grow with the size of the result.
+
+    Parameters:
+        - after (dict): Keyset of the last document already received (see page_key), the stream starts right after it
+        - limit (int): Maximum number of documents, for a page
+
+    Yields:
+        - availability documents (dict), shaped like the slot layout whatever the storage layout
+    """
+    collection = get_availabilities_collection(mongodb_client)
+
+    if AVAILABILITY_LAYOUT == 'buckets':
+        # Slots are unwound and sorted in MongoDB, the start time is compared in minutes
+        fields = ('availability_date', 'start_minute', 'club', 'court', 'availability_duration')
+        pipeline = [{'$match': build_mongo_query(query_filters.model_dump(mode = 'json', include= set(BUCKET_FIELDS)))}]
+        pipeline.extend(slot_stream_stages())
+        slot_filters = unwound_slot_filters(query_filters)
+        if slot_filters:
+            pipeline.append({'$match': slot_filters})
+        if after is not None:
+            after = {**after, 'start_minute': to_minutes(after['availability_time'])}
+            pipeline.append({'$match': keyset_condition(after, fields)})
+        pipeline.append({'$sort': {field: 1 for field in fields}})
+        if limit:
+            pipeline.append({'$limit': limit})
+
+        cursor = await collection.aggregate(pipeline, batchSize= READ_BATCH_SIZE)
+        async for document in cursor:
+            yield from_unwound_slot(document)
+        return
+
+    query = build_mongo_query(query_filters.model_dump(mode = 'json'))
+    if after is not None:
+        query = {'$and': [query, keyset_condition(after)]}
+    cursor = collection.find(query,
+                             projection= AVAILABILITY_PROJECTION,
+                             sort= [(field, 1) for field in PAGE_KEY_FIELDS],
+                             batch_size= READ_BATCH_SIZE,
+                             limit= limit or 0)
+    async for document in cursor:
+        yield document
+
+
+@timed('crud.query_availabilities')
+async def query_availabilities(mongodb_client:AsyncMongoClient,
+                              query_filters:schemas.AvailabilityRead,
+                              use_cache:bool = True):
+    """
+    Query the availabilities matching a AvailabilityRead model.
+    Results are served from the in-process read replica when it covers the queried date (see replica.py),
+    otherwise from the in-process read cache when the same filters were queried recently,
+    the cache is invalidated per (club, date) whenever new availabilities are written.
+    """
+    if read_replica.serves(query_filters.availability_date):
+        return read_replica.query(query_filters)
+
+    if use_cache:
+        cached = availability_cache.get(query_filters)
+        if cached is not None:
+            return cached
+
+    collection = get_availabilities_collection(mongodb_client)
+                 
+    try:
+        if AVAILABILITY_LAYOUT == 'buckets':
+            result = await find_buckets(collection, query_filters)
+        else:
+            cursor = collection.find(build_mongo_query(query_filters.model_dump(mode = 'json')), projection= AVAILABILITY_PROJECTION)
             result = await cursor.to_list()
-            return result
-        
-        except Exception as e:
-            print(str(e))
-            return False
-        
+        if use_cache:
+            availability_cache.set(query_filters, result)
+        return result
+    
+    except Exception as e:
+        print(str(e))
+        return False
     
 
+async def load_live_availabilities(mongodb_client:AsyncMongoClient, since:date):
+    """
+    Stream every availability dated {since} or later, shaped like the slot layout whatever the storage layout,
+    to load the read replica.
+    """
+    collection = get_availabilities_collection(mongodb_client)
+    query = {'availability_date': {'$gte': since.isoformat()}}
+
+    if AVAILABILITY_LAYOUT == 'buckets':
+        async for bucket in collection.find(query, projection= {'_id': 0, 'expires_at': 0}, batch_size= READ_BATCH_SIZE):
+            for slot in flatten_bucket(bucket):
+                yield slot
+        return
+
+    async for document in collection.find(query, projection= AVAILABILITY_PROJECTION, batch_size= READ_BATCH_SIZE):
+        yield document
+
+
+@timed('crud.query_free_windows')
+async def query_free_windows(mongodb_client:AsyncMongoClient,
+                             query_filters:schemas.FreeWindowRead,
+                             longest:bool = False) -> List[dict]:
+    """
+    Query the free windows matching a FreeWindowRead model. Windows overlapping the [time_from, time_to] part
+    of the day are clipped to it, and must still last {min_duration} minutes once clipped.
+
+    Parameters:
+        - longest (bool): Only return the longest window of each club
+
+    Returns:
+        - free windows (List[dict]) : window documents, with available_from, available_to ('HH:MM:SS') and
+          available_minutes giving the part of the window inside the searched period
+    """
+    collection = get_free_windows_collection(mongodb_client)
+    day_start = to_minutes(query_filters.time_from) if query_filters.time_from is not None else 0
+    day_end = to_minutes(query_filters.time_to) if query_filters.time_to is not None else None
+
+    match = build_mongo_query(query_filters.model_dump(mode = 'json', include= set(WINDOW_FIELDS)))
+    overlap = [{'end_minute': {'$gt': day_start}}]
+    if day_end is not None:
+        overlap.append({'start_minute': {'$lt': day_end}})
+    clipped_end = {'$min': ['$end_minute', day_end]} if day_end is not None else '$end_minute'
+
+    pipeline = [
+        {'$match': {'$and': [match, *overlap]}},
+        {'$set': {'available_start': {'$max': ['$start_minute', day_start]}, 'available_end': clipped_end}},
+        {'$set': {'available_minutes': {'$subtract': ['$available_end', '$available_start']}}},
+    ]
+    if query_filters.min_duration is not None:
+        pipeline.append({'$match': {'available_minutes': {'$gte': query_filters.min_duration}}})
+    if longest:
+        pipeline.extend([
+            {'$sort': {'available_minutes': -1, 'available_start': 1}},
+            {'$group': {'_id': '$club', 'window': {'$first': '$$ROOT'}}},
+            {'$replaceRoot': {'newRoot': '$window'}},
+        ])
+    pipeline.extend([
+        {'$sort': {'club': 1, 'court': 1, 'start_minute': 1}},
+        {'$project': {'_id': 0, 'expires_at': 0}},
+    ])
+
+    cursor = await collection.aggregate(pipeline)
+    windows = await cursor.to_list()
+    for window in windows:
+        window['available_from'] = from_minutes(window.pop('available_start'))
+        window['available_to'] = from_minutes(window.pop('available_end'))
+    return windows
+
+
+@timed('crud.delete_availabilities')
 async def delete_availabilities(mongodb_client:AsyncMongoClient,
                               query_filters:schemas.AvailabilityDelete):
-    async with mongodb_client as client:
-        db = client[os.getenv('MONGODB_DB_TEST')]
-        collection = db.availabilities
-        
-        # Retrieve the non-empty fields
-        mongo_filters = [{k : v} for k, v in query_filters.model_dump(mode = 'json').items() if v is not None]
-        
-        # reformat fields that are lists into $in
-        formatted_filters = []
-        for filter in mongo_filters:
-            for k, v in filter.items(): 
-                if isinstance(v, list):
-                    formatted_filters.append({k : {'$in' : v}})
-                else:
-                    formatted_filters.append({k:v})
-                     
-        try:
-            if len(formatted_filters) == 1:
-                final_query = formatted_filters[0]
-            else:
-                final_query = {"$and": formatted_filters}
-            
-            print(f'query filter looks like : {final_query}')
-            result = await collection.delete_many(final_query)
-            return result
-        
-        except Exception as e:
-            print(str(e))
-            return False
+    """
+    Delete the availabilities matching a AvailabilityDelete model, which always holds at least one filter.
+    """
+    collection = get_availabilities_collection(mongodb_client)
+    final_query = build_mongo_query(query_filters.model_dump(mode = 'json'))
+    if not final_query.get('$and', True):
+        raise ValueError('Refusing to delete availabilities without any filter')
+                 
+    try:
+        print(f'query filter looks like : {final_query}')
+        result = await collection.delete_many(final_query)
+        availability_cache.clear()
+        read_replica.remove(query_filters)
+        return result
+    
+    except Exception as e:
+        print(str(e))
+        return False
+
+
+async def purge_past_availabilities(mongodb_client:AsyncMongoClient,
+                                    before:date | None = None):
+    """
+    Bulk delete every availability and free window whose date is strictly before {before} (today in Reunion by default).
+    The TTL indexes on expires_at remove the same documents eventually, this purge reclaims the space right away.
+    """
+    before = before or datetime.now(ZoneInfo("Indian/Reunion")).date()
+    result = await delete_availabilities(mongodb_client, schemas.AvailabilityDelete(availability_date_before= before))
+    windows = await get_free_windows_collection(mongodb_client).delete_many({'availability_date': {'$lt': before.isoformat()}})
+    print(f'{windows.deleted_count} free windows purged')
+    return result
 
 
-async def main_query(client, query_filters):
-    availabilities = await query_availabilities(client, query_filters)
-    print(availabilities)
+async def backfill_minutes(mongodb_client:AsyncMongoClient):
+    """
+    Add start_minute and end_minute to the slots stored before they existed, computed in MongoDB from the
+    'HH:MM:SS' availability_time, so that the range searches also match them.
+    Only the slot layout needs it: buckets store their slots in minutes of day, and the free windows
+    always carry their start_minute and end_minute.
+
+    Returns:
+        - result (UpdateResult | None) : None with the bucket layout, nothing to backfill
+    """
+    if AVAILABILITY_LAYOUT == 'buckets':
+        return None
+    collection = get_availabilities_collection(mongodb_client)
+    start_minute = {'$add': [{'$multiply': [{'$toInt': {'$substrCP': ['$availability_time', 0, 2]}}, 60]},
+                             {'$toInt': {'$substrCP': ['$availability_time', 3, 2]}}]}
+    return await collection.update_many(
+        {'start_minute': {'$exists': False}},
+        [{'$set': {'start_minute': start_minute}},
+         {'$set': {'end_minute': {'$add': ['$start_minute', '$availability_duration']}}}]
+    )
+
+
+async def main_query(user, password, query_filters):
+    async with instantiate_mongodb_client(user, password) as client:
+        availabilities = await query_availabilities(client, query_filters)
+        print(availabilities)
     
-async def main_delete(client, query_filters):
-    deleted = await delete_availabilities(client, query_filters)
-    print(deleted) 
+async def main_delete(user, password, query_filters):
+    async with instantiate_mongodb_client(user, password) as client:
+        deleted = await delete_availabilities(client, query_filters)
+        print(deleted) 
     
-async def main_freshness(client, query_filters):
-    freshness = await check_freshness(client, query_filters, 10)
-    print(freshness)
+async def main_freshness(user, password, query_filters):
+    async with instantiate_mongodb_client(user, password) as client:
+        freshness = await check_freshness(client, query_filters, 10)
+        print(freshness)
+
+async def main_purge(user, password, before):
+    async with instantiate_mongodb_client(user, password) as client:
+        purged = await purge_past_availabilities(client, before)
+        print(purged)
+
+async def main_backfill(user, password):
+    async with instantiate_mongodb_client(user, password) as client:
+        backfilled = await backfill_minutes(client)
+        print(f'{backfilled.modified_count if backfilled else 0} availabilities backfilled')
  
  
 if __name__ == '__main__':
@@ -152,12 +690,17 @@ if __name__ == '__main__':
     parser.add_argument("--date", type=str, required=True, help="The date for the search")
     parser.add_argument("--time", type=str, required=False, help="The time for the search")
     parser.add_argument("--duration", type=str, required=False, help="The duration for the search")
+    parser.add_argument("--time_from", type=str, required=False, help="The earliest start time for a range search")
+    parser.add_argument("--time_to", type=str, required=False, help="The latest end time for a range search")
+    parser.add_argument("--min_duration", type=int, required=False, help="The minimum duration for a range search")
+    parser.add_argument("--purge", action= 'store_true', help="Delete every availability dated before --date")
+    parser.add_argument("--backfill", action= 'store_true', help="Add the minutes of day to the availabilities stored without them")
     
     args = parser.parse_args()
     
     ### Test the query function
     # asyncio.run(main_query(
-    #     instantiate_mongodb_client(args.mongodb_user, args.mongodb_password),
+    #     args.mongodb_user, args.mongodb_password,
     #     schemas.AvailabilityRead(
     #         region = args.region,
     #         city = args.city,
@@ -165,13 +708,16 @@ if __name__ == '__main__':
     #         court = args.court,
     #         availability_date = datetime.strptime(args.date, "%d/%m/%Y").date(),
     #         availability_time = args.time,
-    #         availability_duration = args.duration
+    #         availability_duration = args.duration,
+    #         time_from = args.time_from,
+    #         time_to = args.time_to,
+    #         min_duration = args.min_duration
     #     )
     # ))
 
     ### Test the delete function
     # asyncio.run(main_delete(
-    #     instantiate_mongodb_client(args.mongodb_user, args.mongodb_password),
+    #     args.mongodb_user, args.mongodb_password,
     #     schemas.AvailabilityRead(
     #         region = args.region,
     #         city = args.city,
@@ -181,16 +727,25 @@ if __name__ == '__main__':
     #     )
     # ))
 
+    ### Purge the availabilities dated before --date
+    if args.purge:
+        asyncio.run(main_purge(args.mongodb_user, args.mongodb_password, datetime.strptime(args.date, "%d/%m/%Y").date()))
+
+    ### Backfill the minutes of day used by the range searches
+    elif args.backfill:
+        asyncio.run(main_backfill(args.mongodb_user, args.mongodb_password))
+
     ## Test the freshness function
-    asyncio.run(main_freshness(
-            instantiate_mongodb_client(args.mongodb_user, args.mongodb_password),
-            schemas.AvailabilityRead(
-                region = args.region,
-                city = args.city,
-                club = args.club,
-                court = args.court,
-                availability_date = datetime.strptime(args.date, "%d/%m/%Y").date(),
-                availability_time = args.time,
-                availability_duration = args.duration
-            )
-        ))
\ No newline at end of file
+    else:
+        asyncio.run(main_freshness(
+                args.mongodb_user, args.mongodb_password,
+                schemas.AvailabilityRead(
+                    region = args.region,
+                    city = args.city,
+                    club = args.club,
+                    court = args.court,
+                    availability_date = datetime.strptime(args.date, "%d/%m/%Y").date(),
+                    availability_time = args.time,
+                    availability_duration = args.duration
+                )
+            ))
\ No newline at end of file
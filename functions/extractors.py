@@ -0,0 +1,107 @@
+import re
+from dataclasses import dataclass, field
+from html import unescape
+from html.parser import HTMLParser
+from typing import List, Tuple
+
+
+# Arguments of the Alpine handler of a slot button: selectSlot('Padel 1', '08:00', [60,90])
+SELECT_SLOT_PATTERN = re.compile(r"selectSlot\(\s*'([^']*)'\s*,\s*'([^']*)'\s*,\s*\[([^\]]*)\]")
+
+# Whole @click attribute of a slot button, as found in the raw HTML. The handler may run other statements
+# before selectSlot, e.g. @click="open = false; selectSlot(...)"
+SELECT_SLOT_ATTRIBUTE_PATTERN = re.compile(r'@click\s*=\s*"([^"]*selectSlot\([^"]*)"')
+
+
+@dataclass
+class ChampFleuriPage:
+    """
+    Data extracted from a Champ-Fleuri page.
+
+    Attributes:
+        - csrf_token (str): Value of the _token input, or of the csrf-token meta tag if there is no such input
+        - snapshot (str): Longest wire:snapshot attribute of the page, i.e. the availabilities component
+        - slots (List[tuple]): (court, 'HH:MM', [durations]) of every selectSlot button
+    """
+    csrf_token: str | None = None
+    snapshot: str | None = None
+    slots: List[Tuple[str, str, List[int]]] = field(default_factory= list)
+
+
+def parse_select_slot(click_attr: str) -> Tuple[str, str, List[int]] | None:
+    """
+    Parse the arguments of a selectSlot(...) handler into (court, 'HH:MM', [durations]).
+    """
+    match = SELECT_SLOT_PATTERN.search(click_attr)
+    if match is None:
+        return None
+    court, start, durations = match.groups()
+    return court, start, [int(duration) for duration in durations.split(',') if duration.strip()]
+
+
+class ChampFleuriExtractor(HTMLParser):
+    """
+    Streaming extractor for the Champ-Fleuri pages: the CSRF token, the Livewire snapshot and the slot buttons
+    are collected from the start tags in a single pass, without building a DOM tree.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs= True)
+        self.csrf_meta = None
+        self.csrf_input = None
+        self.page = ChampFleuriPage()
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta':
+            attributes = dict(attrs)
+            if attributes.get('name') == 'csrf-token':
+                self.csrf_meta = attributes.get('content')
+
+        elif tag == 'input':
+            attributes = dict(attrs)
+            if attributes.get('name') == '_token' and self.csrf_input is None:
+                self.csrf_input = attributes.get('value')
+
+        elif tag == 'div':
+            for name, value in attrs:
+                if name == 'wire:snapshot' and value is not None:
+                    if self.page.snapshot is None or len(value) >= len(self.page.snapshot):
+                        self.page.snapshot = value
+                    break
+
+        elif tag == 'button':
+            for name, value in attrs:
+                if name == '@click' and value and 'selectSlot' in value:
+                    slot = parse_select_slot(value)
+                    if slot is not None:
+                        self.page.slots.append(slot)
+                    break
+
+    handle_startendtag = handle_starttag
+
+    def result(self) -> ChampFleuriPage:
+        self.close()
+        self.page.csrf_token = self.csrf_input if self.csrf_input is not None else self.csrf_meta
+        return self.page
+
+
+def extract_champ_fleuri_page(html: str) -> ChampFleuriPage:
+    """
+    Extract the CSRF token, the longest Livewire snapshot and the slot buttons of a Champ-Fleuri page in one pass.
+    """
+    extractor = ChampFleuriExtractor()
+    extractor.feed(html)
+    return extractor.result()
+
+
+def extract_select_slots(html: str) -> List[Tuple[str, str, List[int]]]:
+    """
+    Extract the (court, 'HH:MM', [durations]) of every selectSlot button of a Livewire effects.html fragment.
+    The fragment only needs the button handlers, so they are matched directly in the raw HTML.
+    """
+    slots = []
+    for match in SELECT_SLOT_ATTRIBUTE_PATTERN.finditer(html):
+        slot = parse_select_slot(unescape(match.group(1)))
+        if slot is not None:
+            slots.append(slot)
+    return slots
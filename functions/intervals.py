@@ -0,0 +1,77 @@
+from typing import Dict, Iterable, List, Tuple
+from buckets import to_minutes, from_minutes
+
+
+# Fields identifying the free windows of a court: one set of windows per (club, court, date)
+WINDOW_KEY_FIELDS = ('club', 'court', 'availability_date')
+
+# Fields shared by every window of a court, copied from its slots
+WINDOW_FIELDS = ('region', 'city', 'club', 'court', 'availability_date')
+
+
+def merge_intervals(intervals: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Merge (start, end) intervals into maximal disjoint intervals with a sorted sweep.
+    Intervals that overlap or touch (one ends when the next starts) are merged.
+
+    Parameters:
+        - intervals (Iterable[tuple]): (start, end) pairs, in any order, possibly overlapping or repeated
+
+    Returns:
+        - merged intervals (List[tuple]) : sorted, disjoint and non-touching (start, end) pairs
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def slot_interval(document: dict) -> Tuple[int, int]:
+    """
+    (start, end) in minutes of day of a slot document, from its start time and duration.
+    """
+    start = to_minutes(document['availability_time'])
+    return start, start + int(document['availability_duration'])
+
+
+def to_window_documents(slot_documents: Iterable[dict]) -> List[dict]:
+    """
+    Merge the slots of each (club, court, date) into its maximal free windows.
+    The scrapers describe the same free time differently (the longest duration of a start, one slot per duration,
+    one slot per price), the windows are the union of all of it, whatever the club.
+
+    Returns:
+        - free windows (List[dict]) : one document per window, with the fields of the court, start_minute, end_minute,
+          duration, start_time and end_time ('HH:MM:SS'), and the newest scraping_datetime and expires_at of its court
+    """
+    courts: Dict[tuple, dict] = {}
+    for document in slot_documents:
+        key = tuple(document[field] for field in WINDOW_KEY_FIELDS)
+        court = courts.get(key)
+        if court is None:
+            court = {field: document[field] for field in WINDOW_FIELDS}
+            court.update({'scraping_datetime': document['scraping_datetime'], 'expires_at': document.get('expires_at'), 'intervals': []})
+            courts[key] = court
+
+        court['intervals'].append(slot_interval(document))
+        court['scraping_datetime'] = max(court['scraping_datetime'], document['scraping_datetime'])
+        if document.get('expires_at') is not None:
+            court['expires_at'] = max(court['expires_at'] or document['expires_at'], document['expires_at'])
+
+    windows = []
+    for court in courts.values():
+        intervals = court.pop('intervals')
+        if court['expires_at'] is None:
+            del court['expires_at']
+        for start, end in merge_intervals(intervals):
+            windows.append({**court,
+                            'start_minute': start,
+                            'end_minute': end,
+                            'duration': end - start,
+                            'start_time': from_minutes(start),
+                            'end_time': from_minutes(end)})
+    return windows
@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Tuple
+
+
+# Upper bounds of the latency histograms, in seconds
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Request header asking for the timing spans of a request, sent back in a Server-Timing header
+PROFILE_HEADER = 'X-Profile'
+
+# Profile every request, without the header
+METRICS_PROFILE_ALL = os.getenv('METRICS_PROFILE_ALL', '').lower() in ('1', 'true', 'yes')
+
+# Help text of each metric, written in the /metrics output
+METRIC_HELP = {
+    'padel_span_seconds': ('histogram', 'Duration of the instrumented stages (scraper phases, CRUD operations)'),
+    'padel_span_errors_total': ('counter', 'Instrumented stages that raised an exception'),
+    'padel_request_seconds': ('histogram', 'Latency of the HTTP requests, per route and status'),
+    'padel_scrape_jobs_total': ('counter', 'Scraping jobs per club and final status'),
+    'padel_query_cache': ('gauge', 'State of the availability read cache'),
+    'padel_refresh_in_flight': ('gauge', 'Background refreshes running'),
+    'padel_webhook_queue': ('gauge', 'State of the WhatsApp work queue'),
+    'padel_rate_limit_wait_seconds_total': ('counter', 'Time spent waiting for the rate limiter of each club website'),
+    'padel_circuit_open': ('gauge', 'Clubs whose circuit breaker is open or half-open'),
+}
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets, in the Prometheus format.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        counts = []
+        total = 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+def _labels_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class MetricsRegistry:
+    """
+    In-process counters, gauges and histograms, keyed by metric name and labels.
+    Stages run in worker threads as well as in the event loop, so every update takes a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[tuple, float]] = {}
+        self.gauges: Dict[str, Dict[tuple, float]] = {}
+        self.histograms: Dict[str, Dict[tuple, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges.setdefault(name, {})[_labels_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name, series in sorted(metrics.items()):
+                    lines.append(f'# HELP {name} {METRIC_HELP.get(name, (kind, name))[1]}')
+                    lines.append(f'# TYPE {name} {kind}')
+                    for labels, value in sorted(series.items()):
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f'# HELP {name} {METRIC_HELP.get(name, ("histogram", name))[1]}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in sorted(series.items()):
+                    for bound, count in zip(histogram.buckets, histogram.cumulative_counts()):
+                        lines.append(f'{name}_bucket{_format_labels(labels, (("le", str(bound)),))} {count}')
+                    lines.append(f'{name}_bucket{_format_labels(labels, (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry, exposed on /metrics
+metrics = MetricsRegistry()
+
+# Spans of the request being profiled: [(name, seconds), ...], or None when the request is not profiled.
+# Context variables follow the request into its tasks and into asyncio.to_thread.
+_profile: ContextVar[list | None] = ContextVar('profile', default= None)
+
+
+@contextmanager
+def span(name: str, **labels):
+    """
+    Time a stage: the duration is recorded in the padel_span_seconds histogram,
+    and in the profile of the current request when it is profiled.
+
+    Parameters:
+        - name (str): Name of the stage, e.g. 'scraper.login' or 'crud.query_availabilities'
+        - labels: Extra labels of the histogram, e.g. club='TCD'
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        metrics.inc('padel_span_errors_total', span= name, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('padel_span_seconds', elapsed, span= name, **labels)
+        profile = _profile.get()
+        if profile is not None:
+            profile.append((name, elapsed))
+
+
+def timed(name: str):
+    """
+    Decorator running a coroutine function inside a span.
+    """
+    def decorator(function):
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_profile() -> list:
+    """
+    Start collecting the spans of the current request.
+    """
+    profile = []
+    _profile.set(profile)
+    return profile
+
+
+def server_timing(profile: list, total_seconds: float) -> str:
+    """
+    Server-Timing header of a profiled request: the total time of each span name, in milliseconds.
+    """
+    totals: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    for name, seconds in profile:
+        totals[name] = totals.get(name, 0) + seconds
+        counts[name] = counts.get(name, 0) + 1
+    entries = [f'{name};dur={seconds * 1000:.2f};desc="x{counts[name]}"' for name, seconds in totals.items()]
+    entries.append(f'total;dur={total_seconds * 1000:.2f}')
+    return ', '.join(entries)
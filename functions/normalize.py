@@ -0,0 +1,58 @@
+from datetime import datetime, time
+from typing import Dict, Iterable, List, Tuple
+from pydantic import TypeAdapter
+import schemas
+from metrics import span
+
+
+# Validator of a whole list of availabilities, built once and reused by every scraper
+AVAILABILITY_BATCH = TypeAdapter(List[schemas.AvailabilityCreate])
+
+
+def normalize_slots(raw_slots: Iterable[Tuple[str, str | time, int]],
+                    region: str,
+                    city: str,
+                    club: str,
+                    selected_date: str,
+                    scraping_datetime: datetime) -> List[schemas.AvailabilityCreate]:
+    """
+    Shared slot normalization stage of the scrapers.
+    Raw (court, start time, duration) tuples are deduplicated on that hashable key, the date is parsed once
+    for the whole batch, and the batch is validated in a single TypeAdapter call.
+
+    Parameters:
+        - raw_slots (Iterable[tuple]): (court, start time as 'HH:MM' or time, duration in minutes), possibly repeated
+        - region, city, club (str): Location of the club, shared by every slot
+        - selected_date (str): Date of the slots, in the format 'DD/MM/YYYY'
+        - scraping_datetime (datetime): Time of the scrape, shared by every slot
+
+    Returns:
+        - list of court availabilities (List[schemas.AvailabilityCreate]) : unique availabilities, in scraping order
+    """
+
+    availability_date = datetime.strptime(selected_date, "%d/%m/%Y").date()
+
+    # Start times repeat a lot across courts and windows, each distinct string is parsed once
+    parsed_times: Dict[str, time] = {}
+    unique_slots = {}
+    for court, start, duration in raw_slots:
+        if isinstance(start, str):
+            if start not in parsed_times:
+                parsed_times[start] = time.fromisoformat(start)
+            start = parsed_times[start]
+        unique_slots.setdefault((court, start, int(duration)), None)
+
+    with span('scraper.validate', club= club):
+        return AVAILABILITY_BATCH.validate_python([
+            {
+                'scraping_datetime': scraping_datetime,
+                'region': region,
+                'city': city,
+                'club': club,
+                'court': court,
+                'availability_date': availability_date,
+                'availability_time': start,
+                'availability_duration': duration,
+            }
+            for court, start, duration in unique_slots
+        ])
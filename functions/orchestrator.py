@@ -0,0 +1,228 @@
+import asyncio
+import os
+import time
+from functools import partial
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List
+import schemas
+from database import instantiate_mongodb_client
+from crud import replace_availabilities
+from scraper_cf import scrape_champ_fleuri
+from scraper_tcd import scrape_tcd
+from scraper_oasis import scrape_oasis
+from resilience import CircuitOpen, circuit_breakers
+from metrics import metrics
+
+
+# Scraper coroutine function used for each club, run on the event loop and cancelled when its time budget runs out.
+# A scraper may return None when the club data has not changed since its previous call (Oasis ETag validation)
+SCRAPERS = {
+    'Champ-Fleuri': scrape_champ_fleuri,
+    'TCD': scrape_tcd,
+    'Oasis': partial(scrape_oasis, only_if_changed= True),
+}
+
+# Maximum number of dates scraped at the same time for each club
+CLUB_CONCURRENCY = {
+    'Champ-Fleuri': 1,
+    'TCD': 2,
+    'Oasis': 4,
+}
+
+# Overall time budget for a refresh, in seconds
+DEFAULT_DEADLINE = 120
+
+# Time budget of a single (club, date) job once it has a slot in the club semaphore, in seconds,
+# so that a hung club gives its slot back instead of holding it until the overall deadline
+CLUB_JOB_TIMEOUT = float(os.getenv('CLUB_JOB_TIMEOUT', 45))
+
+
+def credentials_from_env() -> Dict[str, dict]:
+    """
+    Club accounts used by the app, read from the CF_USERNAME, CF_PASSWORD, TCD_USERNAME and TCD_PASSWORD variables.
+    """
+    return {
+        'Champ-Fleuri': {'username': os.getenv('CF_USERNAME'), 'password': os.getenv('CF_PASSWORD')},
+        'TCD': {'username': os.getenv('TCD_USERNAME'), 'password': os.getenv('TCD_PASSWORD')},
+    }
+
+
+def date_range(start_date: date, end_date: date) -> List[date]:
+    """
+    Returns every date between start_date and end_date, both included.
+    """
+    return [start_date + timedelta(days= i) for i in range((end_date - start_date).days + 1)]
+
+
+def skipped_job(club: str, selected_date: date, reason: str) -> schemas.ScrapeJobResult:
+    print(f'Scraping skipped for {club} on the {selected_date}: {reason}')
+    metrics.inc('padel_scrape_jobs_total', club= club, status= 'skipped')
+    return schemas.ScrapeJobResult(club= club, availability_date= selected_date, status= 'skipped', error= reason)
+
+
+async def run_scrape_job(club: str,
+                         selected_date: date,
+                         credentials: Dict[str, dict],
+                         semaphore: asyncio.Semaphore) -> schemas.ScrapeJobResult:
+    """
+    Run the scraper of {club} for a single date, once a slot is free in the club semaphore.
+    Scraping errors are caught and reported in the job status instead of being raised.
+    The job is skipped right away while the circuit breaker of the club is open, and every outcome
+    (including a cancellation by the caller's deadline) is recorded in the breaker.
+    """
+
+    scraper = SCRAPERS[club]
+    club_credentials = credentials.get(club, {})
+    formatted_date = selected_date.strftime("%d/%m/%Y")
+    breaker = circuit_breakers.get(club)
+
+    # Skip without waiting for the semaphore, which is probably held by a job stuck on the same site
+    if breaker.state == 'open':
+        return skipped_job(club, selected_date, f'Circuit of {club} is open')
+
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            breaker.before_call()
+        except CircuitOpen as e:
+            return skipped_job(club, selected_date, str(e))
+
+        try:
+            availabilities = await asyncio.wait_for(
+                scraper(club_credentials.get('username'), club_credentials.get('password'), formatted_date),
+                timeout= CLUB_JOB_TIMEOUT
+            )
+
+        except asyncio.CancelledError:
+            breaker.record_failure()
+            raise
+
+        except Exception as e:
+            breaker.record_failure()
+            job_status = 'timeout' if isinstance(e, asyncio.TimeoutError) else 'failed'
+            print(f'Scraping failed for {club} on the {formatted_date}: {e!r}')
+            metrics.inc('padel_scrape_jobs_total', club= club, status= job_status)
+            return schemas.ScrapeJobResult(
+                club= club,
+                availability_date= selected_date,
+                status= job_status,
+                error= f'Job budget of {CLUB_JOB_TIMEOUT}s exceeded' if job_status == 'timeout' else repr(e),
+                duration_seconds= time.perf_counter() - start
+            )
+
+    breaker.record_success()
+    result = schemas.ScrapeJobResult(
+        club= club,
+        availability_date= selected_date,
+        status= 'unchanged' if availabilities is None else 'success',
+        duration_seconds= time.perf_counter() - start,
+        availabilities= availabilities or []
+    )
+    metrics.inc('padel_scrape_jobs_total', club= club, status= result.status)
+    return result
+
+
+async def scrape_clubs(clubs: Iterable[str],
+                       start_date: date,
+                       end_date: date,
+                       credentials: Dict[str, dict] | None = None,
+                       club_concurrency: Dict[str, int] | None = None,
+                       deadline: float = DEFAULT_DEADLINE) -> List[schemas.ScrapeJobResult]:
+    """
+    Scrape every (club, date) pair concurrently on the running event loop.
+
+    Parameters:
+        - clubs (Iterable[str]): Clubs to scrape, must be keys of SCRAPERS
+        - start_date (date): First date to scrape
+        - end_date (date): Last date to scrape (included)
+        - credentials (dict): {club : {'username' : ..., 'password' : ...}} for the clubs that require a login
+        - club_concurrency (dict): {club : max number of dates scraped at the same time}, defaults to CLUB_CONCURRENCY
+        - deadline (float): Overall time budget in seconds. Jobs still running when it expires are cancelled
+
+    Returns:
+        - job results (List[schemas.ScrapeJobResult]) : One result per (club, date), with the scraped availabilities
+          for successful jobs, a status of 'unchanged' when the club data did not change since the previous scrape,
+          'skipped' when the circuit breaker of the club is open, and a status of 'failed' or 'timeout' for the others
+    """
+
+    credentials = credentials or {}
+    club_concurrency = {**CLUB_CONCURRENCY, **(club_concurrency or {})}
+
+    unknown_clubs = set(clubs) - set(SCRAPERS)
+    if unknown_clubs:
+        raise ValueError(f'No scraper available for {sorted(unknown_clubs)}')
+
+    semaphores = {club: asyncio.Semaphore(club_concurrency.get(club, 1)) for club in clubs}
+    jobs = {}
+    for club in clubs:
+        for selected_date in date_range(start_date, end_date):
+            task = asyncio.create_task(run_scrape_job(club, selected_date, credentials, semaphores[club]))
+            jobs[task] = (club, selected_date)
+
+    if not jobs:
+        return []
+
+    done, pending = await asyncio.wait(jobs, timeout= deadline)
+
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions= True)
+
+    results = []
+    for task, (club, selected_date) in jobs.items():
+        if task in done:
+            results.append(task.result())
+        else:
+            print(f'Deadline reached before {club} could be scraped for the {selected_date}')
+            metrics.inc('padel_scrape_jobs_total', club= club, status= 'timeout')
+            results.append(schemas.ScrapeJobResult(
+                club= club,
+                availability_date= selected_date,
+                status= 'timeout',
+                error= f'Deadline of {deadline}s exceeded'
+            ))
+
+    return results
+
+
+async def main_scrape():
+    credentials = {
+        'Champ-Fleuri': {'username': args.cf_username, 'password': args.cf_password},
+        'TCD': {'username': args.tcd_username, 'password': args.tcd_password},
+    }
+
+    results = await scrape_clubs(
+        clubs= args.club or list(SCRAPERS),
+        start_date= datetime.strptime(args.start_date, "%d/%m/%Y").date(),
+        end_date= datetime.strptime(args.end_date, "%d/%m/%Y").date(),
+        credentials= credentials,
+        deadline= args.deadline
+    )
+
+    for result in results:
+        print(f'{result.club} - {result.availability_date} : {result.status} ({len(result.availabilities)} availabilities)')
+
+    if args.mongodb_user:
+        async with instantiate_mongodb_client(args.mongodb_user, args.mongodb_password) as client:
+            for result in results:
+                if result.status == 'success':
+                    await replace_availabilities(client, result.club, result.availability_date, result.availabilities)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='scrape several clubs over a range of dates')
+    parser.add_argument("--club", action= 'append', type=str, required=False, help="The club to scrape, all clubs with a scraper if omitted")
+    parser.add_argument("--start_date", type=str, required=True, help="The first date to scrape in the format DD/MM/YYYY")
+    parser.add_argument("--end_date", type=str, required=True, help="The last date to scrape in the format DD/MM/YYYY")
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE, help="The overall time budget of the refresh, in seconds")
+    parser.add_argument("--cf_username", type=str, required=False, help="The username of the CF account")
+    parser.add_argument("--cf_password", type=str, required=False, help="The password for the CF account")
+    parser.add_argument("--tcd_username", type=str, required=False, help="The username of the TCD account")
+    parser.add_argument("--tcd_password", type=str, required=False, help="The password for the TCD account")
+    parser.add_argument("--mongodb_user", type=str, help="The username for the mongodb database if data is to be inserted in a collection")
+    parser.add_argument("--mongodb_password", type=str, help="The password for the mongodb database")
+    args = parser.parse_args()
+
+    asyncio.run(main_scrape())
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+from metrics import metrics
+
+
+# Requests per second and burst allowed on each club website: {host : (rate, burst)}
+# The TCD burst lets the 9 loadCourtDispo windows of a date go out in a single round trip
+DEFAULT_RATE_LIMITS = {
+    'tennispadelchampfleuri.re': (1.0, 1),
+    'dpr.gestion-sports.com': (4.0, 9),
+    'api-v3.doinsport.club': (2.0, 4),
+}
+
+# Overrides, e.g. RATE_LIMITS="dpr.gestion-sports.com=2:4,api-v3.doinsport.club=1:1" for 2 requests per second with a burst of 4
+RATE_LIMITS = os.getenv('RATE_LIMITS', '')
+
+# Rate and burst of the hosts without a configured limit
+RATE_LIMIT_DEFAULT_RATE = float(os.getenv('RATE_LIMIT_DEFAULT_RATE', 2))
+RATE_LIMIT_DEFAULT_BURST = int(os.getenv('RATE_LIMIT_DEFAULT_BURST', 2))
+
+
+def parse_rate_limits(value: str) -> Dict[str, Tuple[float, int]]:
+    """
+    Parse a 'host=rate:burst,host=rate:burst' string into {host : (rate, burst)}.
+    """
+    limits = {}
+    for entry in filter(None, (part.strip() for part in value.split(','))):
+        host, _, limit = entry.partition('=')
+        rate, _, burst = limit.partition(':')
+        limits[host.strip()] = (float(rate), int(burst or 1))
+    return limits
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at {rate} tokens per second, holding at most {burst} tokens.
+    A caller takes a token, or reserves the next one and sleeps until it is due: the event loop is never blocked,
+    and concurrent callers are spread out at the configured rate instead of all waiting a fixed delay.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.waited_seconds = 0.0
+        self.acquired = 0
+        # A thread lock rather than an asyncio one, the bucket is shared by every event loop of the process
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token, possibly in advance.
+
+        Returns:
+            - delay (float) : seconds to wait before sending the request, 0 if a token was available
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            self.acquired += 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited_seconds += delay
+            return delay
+
+    async def acquire(self, at_least: float = 0.0) -> float:
+        """
+        Take a token and sleep until it is due, or for {at_least} seconds if that is longer.
+
+        Returns:
+            - delay (float) : seconds waited because of the rate limit only, beyond {at_least}
+        """
+        delay = self.reserve()
+        if max(delay, at_least) > 0:
+            await asyncio.sleep(max(delay, at_least))
+        return max(delay - at_least, 0.0)
+
+    def stats(self) -> dict:
+        return {'rate': self.rate, 'burst': self.burst, 'acquired': self.acquired, 'waited_seconds': round(self.waited_seconds, 3)}
+
+
+class HostRateLimiter:
+    """
+    One token bucket per host, shared by every scraper that sends requests to it.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]] | None = None):
+        self.limits = {**DEFAULT_RATE_LIMITS, **parse_rate_limits(RATE_LIMITS), **(limits or {})}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, host: str, rate: float, burst: int):
+        """
+        Set the limit of {host}, e.g. to give a local stand-in the limit of the website it replaces.
+        """
+        with self._lock:
+            self.limits[host] = (rate, burst)
+            self._buckets.pop(host, None)
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                rate, burst = self.limits.get(host, (RATE_LIMIT_DEFAULT_RATE, RATE_LIMIT_DEFAULT_BURST))
+                bucket = self._buckets[host] = TokenBucket(rate, burst)
+            return bucket
+
+    async def wait(self, url: str, at_least: float = 0.0):
+        """
+        Wait until a request to the host of {url} is allowed, and for at least {at_least} seconds,
+        e.g. the backoff before a retry. Both delays run at once, the longer one wins.
+        """
+        host = urlsplit(url).netloc
+        delay = await self.bucket(host).acquire(at_least)
+        if delay > 0:
+            metrics.inc('padel_rate_limit_wait_seconds_total', delay, host= host)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {host: bucket.stats() for host, bucket in self._buckets.items()}
+
+
+# Process-wide limiter, used by resilience.request_with_retries for every request sent to a club website
+rate_limiter = HostRateLimiter()
@@ -0,0 +1,203 @@
+import asyncio
+import os
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import Dict, Tuple
+import schemas
+from pymongo import AsyncMongoClient
+from crud import query_availabilities, replace_availabilities, clubs_matching, iter_availabilities, page_key, newest_scraping_datetimes
+from orchestrator import SCRAPERS, CLUB_CONCURRENCY, credentials_from_env, run_scrape_job
+from metrics import metrics
+
+
+# Age after which the data of a (club, date) is refreshed in the background
+STALE_AFTER_MINUTES = float(os.getenv('STALE_AFTER_MINUTES', 30))
+
+# Number of days, starting today, kept warm by the scheduler (see scheduler.py).
+# Reads of later dates never trigger a background refresh
+PREWARM_HORIZON_DAYS = int(os.getenv('PREWARM_HORIZON_DAYS', 14))
+
+# Time budget of a single background refresh, in seconds
+REFRESH_DEADLINE = float(os.getenv('REFRESH_DEADLINE', 60))
+
+
+class AvailabilitiesUnavailable(Exception):
+    """Raised when the stored availabilities could not be read, so that an outage is not mistaken for an empty result."""
+
+
+class RefreshCoordinator:
+    """
+    Runs background scrapes of single (club, date) pairs, with at most one scrape in flight per pair:
+    a refresh requested while the same pair is already being scraped joins the running task.
+    """
+
+    def __init__(self, deadline: float = REFRESH_DEADLINE):
+        self.deadline = deadline
+        self._in_flight: Dict[Tuple[str, date], asyncio.Task] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.last_refreshed: Dict[Tuple[str, date], datetime] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def refresh(self, mongodb_client: AsyncMongoClient, club: str, availability_date: date) -> asyncio.Task:
+        """
+        Start a background scrape of {club} on {availability_date}, or return the one already running.
+        """
+        key = (club, availability_date)
+        task = self._in_flight.get(key)
+        if task is not None and not task.done():
+            self.coalesced += 1
+            return task
+
+        self.started += 1
+        task = asyncio.create_task(self._run(mongodb_client, club, availability_date))
+        self._in_flight[key] = task
+        # A task is done before its callback runs: by then a new refresh of the same pair may have replaced it
+        task.add_done_callback(lambda t: self._in_flight.get(key) is t and self._in_flight.pop(key))
+        return task
+
+    async def _run(self, mongodb_client: AsyncMongoClient, club: str, availability_date: date) -> schemas.ScrapeJobResult:
+        semaphore = self._semaphores.setdefault(club, asyncio.Semaphore(CLUB_CONCURRENCY.get(club, 1)))
+        try:
+            result = await asyncio.wait_for(
+                run_scrape_job(club, availability_date, credentials_from_env(), semaphore),
+                timeout= self.deadline
+            )
+        except asyncio.TimeoutError:
+            metrics.inc('padel_scrape_jobs_total', club= club, status= 'timeout')
+            result = schemas.ScrapeJobResult(club= club, availability_date= availability_date, status= 'timeout',
+                                             error= f'Deadline of {self.deadline}s exceeded')
+
+        if result.status == 'unchanged':
+            # Nothing to write, the stored snapshot is still accurate
+            self.last_refreshed[(club, availability_date)] = datetime.now(ZoneInfo("Indian/Reunion"))
+        elif result.status == 'success':
+            try:
+                await replace_availabilities(mongodb_client, club, availability_date, result.availabilities)
+                self.last_refreshed[(club, availability_date)] = datetime.now(ZoneInfo("Indian/Reunion"))
+            except Exception as e:
+                self.failed += 1
+                print(f'Background refresh of {club} on the {availability_date} could not be saved: {e!r}')
+        else:
+            self.failed += 1
+            print(f'Background refresh of {club} on the {availability_date} ended with status {result.status}')
+
+        return result
+
+    def in_flight(self) -> list:
+        return [{'club': club, 'availability_date': availability_date} for club, availability_date in self._in_flight]
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self.in_flight(),
+            'started': self.started,
+            'coalesced': self.coalesced,
+            'failed': self.failed,
+        }
+
+    async def shutdown(self):
+        """
+        Cancel the refreshes still running, e.g. when the app stops.
+        """
+        tasks = list(self._in_flight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions= True)
+
+
+# Process-wide coordinator shared by every request
+refresh_coordinator = RefreshCoordinator()
+
+
+def revalidate(mongodb_client: AsyncMongoClient,
+               query_filters: schemas.AvailabilityRead,
+               scraped_at: Dict[str, datetime],
+               stale_after_minutes: float = STALE_AFTER_MINUTES) -> dict:
+    """
+    Start a background refresh of every club of the query whose data is older than {stale_after_minutes}.
+    The age of a club is taken from {scraped_at}, or from its last background refresh if that is more recent
+    (a club may have no free slot at all). Only the dates of the scheduler horizon are refreshed: past dates
+    cannot be booked anymore, and dates beyond PREWARM_HORIZON_DAYS are left to the scheduler once they enter it.
+
+    Returns:
+        - freshness (dict) : {club : {'scraped_at' : datetime | None, 'age_seconds' : float | None, 'refreshing' : bool}}
+    """
+    availability_date = query_filters.availability_date
+    now = datetime.now(ZoneInfo("Indian/Reunion"))
+    refreshable = now.date() <= availability_date < now.date() + timedelta(days= PREWARM_HORIZON_DAYS)
+    freshness = {}
+    for club in clubs_matching(query_filters):
+        if club not in SCRAPERS:
+            continue
+
+        timestamps = [t for t in (scraped_at.get(club), refresh_coordinator.last_refreshed.get((club, availability_date))) if t]
+        newest = max(timestamps) if timestamps else None
+        age_seconds = (now - newest).total_seconds() if newest else None
+
+        refreshing = refreshable and (age_seconds is None or age_seconds > stale_after_minutes * 60)
+        if refreshing:
+            refresh_coordinator.refresh(mongodb_client, club, availability_date)
+
+        freshness[club] = {'scraped_at': newest, 'age_seconds': age_seconds, 'refreshing': refreshing}
+
+    return freshness
+
+
+async def read_with_revalidation(mongodb_client: AsyncMongoClient,
+                                 query_filters: schemas.AvailabilityRead,
+                                 stale_after_minutes: float = STALE_AFTER_MINUTES) -> dict:
+    """
+    Stale-while-revalidate read: the stored availabilities are returned right away with their age,
+    and every club whose data is stale gets a background refresh for the queried date (see revalidate).
+    The age of a club is taken from the newest scrape stored for the date, not from the returned slots:
+    a filter on the court or the time may leave out the slots of the latest scrape.
+
+    Returns:
+        - response (dict) : {'availabilities' : [...],
+                             'freshness' : {club : {'scraped_at' : datetime | None, 'age_seconds' : float | None, 'refreshing' : bool}}}
+
+    Raises:
+        - AvailabilitiesUnavailable : if MongoDB could not be queried, no refresh is started then
+    """
+
+    availabilities = await query_availabilities(mongodb_client, query_filters)
+    if availabilities is False:
+        raise AvailabilitiesUnavailable('The availabilities could not be read from MongoDB')
+
+    return {
+        'availabilities': [{k: v for k, v in document.items() if k != '_id'} for document in availabilities],
+        'freshness': await stored_freshness(mongodb_client, query_filters, stale_after_minutes),
+    }
+
+
+async def stored_freshness(mongodb_client: AsyncMongoClient,
+                           query_filters: schemas.AvailabilityRead,
+                           stale_after_minutes: float = STALE_AFTER_MINUTES) -> dict:
+    """
+    Freshness of the clubs of a query, shared by every read: the age of each club comes from the newest scrape
+    stored for the date (an indexed $group) instead of the results, which may be filtered, paginated or streamed.
+    """
+    clubs = [club for club in clubs_matching(query_filters) if club in SCRAPERS]
+    newest_scrapes = await newest_scraping_datetimes(mongodb_client, clubs, [query_filters.availability_date])
+    scraped_at = {club: newest for (club, _), newest in newest_scrapes.items() if newest is not None}
+    return revalidate(mongodb_client, query_filters, scraped_at, stale_after_minutes)
+
+
+async def read_page_with_revalidation(mongodb_client: AsyncMongoClient,
+                                      query_filters: schemas.AvailabilityRead,
+                                      limit: int,
+                                      after: dict | None = None,
+                                      stale_after_minutes: float = STALE_AFTER_MINUTES) -> dict:
+    """
+    One page of a stale-while-revalidate read, with keyset pagination on crud.PAGE_KEY_FIELDS.
+
+    Returns:
+        - response (dict) : {'availabilities' : [...], 'freshness' : {...}, 'next' : keyset of the last document, or None on the last page}
+    """
+    availabilities = [document async for document in iter_availabilities(mongodb_client, query_filters, after, limit)]
+    return {
+        'availabilities': availabilities,
+        'freshness': await stored_freshness(mongodb_client, query_filters, stale_after_minutes),
+        'next': page_key(availabilities[-1]) if len(availabilities) == limit else None,
+    }
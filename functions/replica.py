@@ -0,0 +1,208 @@
+import asyncio
+import os
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+from typing import AsyncIterable, Callable, Dict, Iterable, List, Tuple
+import schemas
+from buckets import to_minutes
+
+
+# Keep a copy of the live availabilities in the process and answer the reads from it
+READ_REPLICA_ENABLED = os.getenv('READ_REPLICA_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+# Follow the writes of the other processes through a MongoDB change stream (replica sets only)
+READ_REPLICA_CHANGE_STREAM = os.getenv('READ_REPLICA_CHANGE_STREAM', '').lower() in ('1', 'true', 'yes')
+
+# Time waited after a change event before reloading, so that a burst of writes triggers a single reload
+READ_REPLICA_RELOAD_DELAY = float(os.getenv('READ_REPLICA_RELOAD_DELAY', 1))
+
+# Fields of the slots kept in the replica, the same as the fields returned by the MongoDB reads
+REPLICA_FIELDS = ('scraping_datetime', 'region', 'city', 'club', 'court',
+                  'availability_date', 'availability_time', 'availability_duration')
+
+# Fields identifying a slot inside a (club, date) snapshot
+REPLICA_KEY_FIELDS = ('court', 'availability_time', 'availability_duration')
+
+
+class ReadReplica:
+    """
+    In-memory copy of the availabilities from {since} onwards, indexed by (date, club).
+    MongoDB stays the system of record: the replica is loaded from it at startup, kept current by the ingest path
+    of this process (crud.replace_availabilities, insert_availabilities, delete_availabilities) and optionally
+    by a change stream for the writes of other processes. Reads on a covered date never leave the process,
+    so they stay fast and keep working while MongoDB is unreachable.
+    """
+
+    def __init__(self, enabled: bool = READ_REPLICA_ENABLED):
+        self.enabled = enabled
+        self.since: date | None = None
+        self.loaded_at: datetime | None = None
+        # {(availability_date, club) : {slot key : (start_minute, end_minute, document)}}
+        self._snapshots: Dict[Tuple[str, str], Dict[tuple, tuple]] = {}
+        self._follower: asyncio.Task | None = None
+        self.reads = 0
+        self.reloads = 0
+
+    @staticmethod
+    def _entry(document: dict) -> tuple:
+        slot = {field: document[field] for field in REPLICA_FIELDS}
+        start_minute = to_minutes(slot['availability_time'])
+        return start_minute, start_minute + int(slot['availability_duration']), slot
+
+    def serves(self, availability_date: date) -> bool:
+        """
+        Whether the reads of {availability_date} can be answered by the replica.
+        The replica covers today onwards, it is rolled forward on the first read of a new day.
+        """
+        if not self.enabled or self.since is None:
+            return False
+        self.advance(datetime.now(ZoneInfo("Indian/Reunion")).date())
+        return availability_date >= self.since
+
+    def advance(self, today: date):
+        """
+        Move {since} forward to {today} and drop the snapshots of the past dates: their slots expire from MongoDB,
+        so the replica would otherwise keep serving them and grow by a day of slots every day.
+        """
+        if self.since is None or today <= self.since:
+            return
+        self.since = today
+        for key in [key for key in self._snapshots if key[0] < today.isoformat()]:
+            del self._snapshots[key]
+
+    async def load(self, documents: AsyncIterable[dict], since: date):
+        """
+        Replace the whole content of the replica by the slot documents of every date from {since} onwards.
+        """
+        snapshots = {}
+        async for document in documents:
+            entry = self._entry(document)
+            key = (document['availability_date'], document['club'])
+            snapshots.setdefault(key, {})[tuple(document[field] for field in REPLICA_KEY_FIELDS)] = entry
+
+        self._snapshots = snapshots
+        self.since = since
+        self.loaded_at = datetime.now(ZoneInfo("Indian/Reunion"))
+        self.reloads += 1
+        print(f'Read replica loaded : {sum(len(slots) for slots in snapshots.values())} availabilities since the {since}')
+
+    def replace_snapshot(self, club: str, availability_date: str, documents: Iterable[dict]):
+        """
+        Replace the slots of a (club, date) by its freshly written snapshot.
+        """
+        if not self.enabled:
+            return
+        slots = {tuple(document[field] for field in REPLICA_KEY_FIELDS): self._entry(document) for document in documents}
+        if slots:
+            self._snapshots[(availability_date, club)] = slots
+        else:
+            self._snapshots.pop((availability_date, club), None)
+
+    def add(self, documents: Iterable[dict]):
+        """
+        Add slots appended to the collection.
+        """
+        if not self.enabled:
+            return
+        for document in documents:
+            key = (document['availability_date'], document['club'])
+            self._snapshots.setdefault(key, {})[tuple(document[field] for field in REPLICA_KEY_FIELDS)] = self._entry(document)
+
+    def remove(self, query_filters: schemas.AvailabilityDelete):
+        """
+        Remove the slots matching a AvailabilityDelete model.
+        """
+        if not self.enabled:
+            return
+        day = query_filters.availability_date.isoformat() if query_filters.availability_date else None
+        before = query_filters.availability_date_before.isoformat() if query_filters.availability_date_before else None
+        for key in list(self._snapshots):
+            availability_date, _ = key
+            if (day is not None and availability_date != day) or (before is not None and availability_date >= before):
+                continue
+            slots = self._snapshots[key]
+            for slot_key, (_, _, slot) in list(slots.items()):
+                if all(not values or slot[field] in values for field, values in (('region', query_filters.region),
+                                                                                   ('city', query_filters.city),
+                                                                                   ('club', query_filters.club),
+                                                                                   ('court', query_filters.court))):
+                    del slots[slot_key]
+            if not slots:
+                del self._snapshots[key]
+
+    def query(self, query_filters: schemas.AvailabilityRead) -> List[dict]:
+        """
+        Availabilities matching a AvailabilityRead model, with the same filters as crud.build_mongo_query.
+        """
+        day = query_filters.availability_date.isoformat()
+        exact_time = query_filters.availability_time.isoformat() if query_filters.availability_time is not None else None
+        time_from = to_minutes(query_filters.time_from) if query_filters.time_from is not None else None
+        time_to = to_minutes(query_filters.time_to) if query_filters.time_to is not None else None
+        list_filters = [(field, set(values)) for field, values in (('region', query_filters.region),
+                                                                   ('city', query_filters.city),
+                                                                   ('court', query_filters.court)) if values]
+        clubs = query_filters.club
+
+        self.reads += 1
+        result = []
+        for (availability_date, club), slots in self._snapshots.items():
+            if availability_date != day or (clubs and club not in clubs):
+                continue
+            for start_minute, end_minute, slot in slots.values():
+                if exact_time is not None and slot['availability_time'] != exact_time:
+                    continue
+                if query_filters.availability_duration is not None and slot['availability_duration'] != query_filters.availability_duration:
+                    continue
+                if time_from is not None and start_minute < time_from:
+                    continue
+                if time_to is not None and end_minute > time_to:
+                    continue
+                if query_filters.min_duration is not None and slot['availability_duration'] < query_filters.min_duration:
+                    continue
+                if any(slot[field] not in values for field, values in list_filters):
+                    continue
+                result.append(dict(slot))
+        return result
+
+    def follow(self, watched_collection, documents: Callable[[date], AsyncIterable[dict]]):
+        """
+        Reload the replica whenever {watched_collection} changes, to pick up the writes of other processes.
+        A change stream needs a replica set, the follower stops with a message when it is not available.
+        """
+        async def run():
+            try:
+                async with await watched_collection.watch() as stream:
+                    async for _ in stream:
+                        await asyncio.sleep(READ_REPLICA_RELOAD_DELAY)
+                        while await stream.try_next() is not None:
+                            pass
+                        today = datetime.now(ZoneInfo("Indian/Reunion")).date()
+                        await self.load(documents(today), today)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f'Read replica change stream stopped, only the writes of this process are applied: {e!r}')
+
+        self._follower = asyncio.create_task(run())
+
+    async def stop(self):
+        if self._follower is not None:
+            self._follower.cancel()
+            await asyncio.gather(self._follower, return_exceptions= True)
+            self._follower = None
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'since': self.since,
+            'loaded_at': self.loaded_at,
+            'snapshots': len(self._snapshots),
+            'availabilities': sum(len(slots) for slots in self._snapshots.values()),
+            'following': self._follower is not None and not self._follower.done(),
+            'reads': self.reads,
+            'reloads': self.reloads,
+        }
+
+
+# Process-wide replica, filled in the FastAPI lifespan
+read_replica = ReadReplica()
@@ -0,0 +1,186 @@
+import os
+import random
+import threading
+import time
+from typing import Dict
+import httpx
+from ratelimit import rate_limiter
+from metrics import span
+
+
+# Time budgets of the requests sent to the club websites, per phase, in seconds.
+# connect: TCP/TLS connection, read: wait for each chunk of the answer, pool: wait for a free connection
+SCRAPER_CONNECT_TIMEOUT = float(os.getenv('SCRAPER_CONNECT_TIMEOUT', 3))
+SCRAPER_POOL_TIMEOUT = float(os.getenv('SCRAPER_POOL_TIMEOUT', 5))
+PHASE_READ_TIMEOUTS = {
+    'login': float(os.getenv('SCRAPER_LOGIN_READ_TIMEOUT', 10)),
+    'fetch': float(os.getenv('SCRAPER_FETCH_READ_TIMEOUT', 10)),
+}
+
+# Retries of a request that failed for a transient reason, and base of the exponential backoff between them
+SCRAPER_RETRIES = int(os.getenv('SCRAPER_RETRIES', 2))
+SCRAPER_BACKOFF_SECONDS = float(os.getenv('SCRAPER_BACKOFF_SECONDS', 0.5))
+SCRAPER_MAX_BACKOFF_SECONDS = float(os.getenv('SCRAPER_MAX_BACKOFF_SECONDS', 5))
+
+# Status codes worth retrying: rate limited, or the website is temporarily down
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Circuit breaker of each club: opened after CIRCUIT_FAILURE_THRESHOLD failed jobs in a row,
+# a single trial job is let through once CIRCUIT_RECOVERY_SECONDS have passed
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 3))
+CIRCUIT_RECOVERY_SECONDS = float(os.getenv('CIRCUIT_RECOVERY_SECONDS', 120))
+
+
+class ScraperError(Exception):
+    """Raised when a club website answered something the scraper cannot use (missing token, unexpected payload...)."""
+
+
+class CircuitOpen(Exception):
+    """Raised when the circuit breaker of a club is open and its scraping job is skipped."""
+
+
+def phase_timeout(phase: str) -> httpx.Timeout:
+    """
+    Timeout of a request sent during {phase} ('login' or 'fetch').
+    """
+    read = PHASE_READ_TIMEOUTS[phase]
+    return httpx.Timeout(connect= SCRAPER_CONNECT_TIMEOUT, read= read, write= read, pool= SCRAPER_POOL_TIMEOUT)
+
+
+def backoff_delay(attempt: int, response: httpx.Response | None = None) -> float:
+    """
+    Time to wait before retry number {attempt} (starting at 0): full jitter over an exponential backoff,
+    or the Retry-After of the response when the website sent one.
+    """
+    if response is not None:
+        retry_after = response.headers.get('retry-after', '')
+        if retry_after.isdigit():
+            return min(float(retry_after), SCRAPER_MAX_BACKOFF_SECONDS)
+    return random.uniform(0, min(SCRAPER_MAX_BACKOFF_SECONDS, SCRAPER_BACKOFF_SECONDS * 2 ** attempt))
+
+
+async def request_with_retries(client: httpx.AsyncClient,
+                               method: str,
+                               url: str,
+                               phase: str,
+                               club: str,
+                               retries: int = SCRAPER_RETRIES,
+                               **kwargs) -> httpx.Response:
+    """
+    Send a request within the time budget of its phase, retrying connection errors, timeouts
+    and retryable status codes with a jittered backoff. Every attempt first waits for the rate limiter of the host:
+    before a retry, the backoff (or Retry-After) and the rate limit delay overlap instead of adding up,
+    the request goes out once both have passed.
+    The wait is recorded in the scraper.rate_limit span and each attempt in the scraper.{phase} span,
+    so that the login and fetch stages only measure the time spent on the network.
+
+    Parameters:
+        - phase (str): 'login' or 'fetch', selects the timeout and the span
+        - club (str): Club of the website, label of the spans
+        - retries (int): Number of retries after the first attempt
+        - kwargs: Passed to httpx.AsyncClient.request
+
+    Returns:
+        - response (httpx.Response) : the last response, whatever its status
+
+    Raises:
+        - httpx.TransportError : if the last attempt could not get a response
+    """
+    backoff = 0.0
+    for attempt in range(retries + 1):
+        with span('scraper.rate_limit', club= club):
+            await rate_limiter.wait(url, at_least= backoff)
+        try:
+            with span(f'scraper.{phase}', club= club):
+                response = await client.request(method, url, timeout= phase_timeout(phase), **kwargs)
+        except httpx.TransportError as e:
+            if attempt == retries:
+                raise
+            print(f'{method} {url} failed ({e!r}), retrying...')
+            backoff = backoff_delay(attempt)
+            continue
+
+        if response.status_code in RETRYABLE_STATUS_CODES and attempt < retries:
+            print(f'{method} {url} answered {response.status_code}, retrying...')
+            backoff = backoff_delay(attempt, response)
+            continue
+        return response
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a club website. After {failure_threshold} failed jobs in a row the circuit opens
+    and the jobs of the club are skipped right away. Once {recovery_seconds} have passed, a single trial job
+    is let through (half-open): the circuit closes if it succeeds and opens again if it fails.
+    """
+
+    def __init__(self, club: str,
+                 failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_seconds: float = CIRCUIT_RECOVERY_SECONDS):
+        self.club = club
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if self.trial_running or time.monotonic() - self.opened_at >= self.recovery_seconds:
+            return 'half_open'
+        return 'open'
+
+    def before_call(self):
+        """
+        Raises:
+            - CircuitOpen : if the circuit is open, or half-open with a trial job already running
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self.trial_running or time.monotonic() - self.opened_at < self.recovery_seconds:
+                raise CircuitOpen(f'Circuit of {self.club} is open after {self.failures} failures in a row')
+            self.trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_running:
+                    print(f'Circuit of {self.club} opened after {self.failures} failures in a row')
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def stats(self) -> dict:
+        return {'state': self.state, 'failures': self.failures}
+
+
+class CircuitBreakers:
+    """
+    Registry of the circuit breakers, one per club.
+    """
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, club: str) -> CircuitBreaker:
+        with self._lock:
+            return self._breakers.setdefault(club, CircuitBreaker(club))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {club: breaker.stats() for club, breaker in self._breakers.items()}
+
+
+# Process-wide breakers shared by the orchestrator, the refresh coordinator and the scheduler
+circuit_breakers = CircuitBreakers()
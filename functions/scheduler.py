@@ -0,0 +1,171 @@
+import asyncio
+import os
+import random
+from collections import deque
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import Dict, Iterable, List, Tuple
+from pymongo import AsyncMongoClient
+from crud import newest_scraping_datetimes
+from orchestrator import SCRAPERS, date_range
+from refresh import RefreshCoordinator, refresh_coordinator, PREWARM_HORIZON_DAYS
+
+
+# Refresh interval of a date depending on how many days ahead it is: [(last day ahead, interval in minutes), ...]
+# Today and tomorrow are refreshed often, far dates rarely
+PREWARM_INTERVALS = [(1, 15), (3, 60), (7, 180), (None, 720)]
+
+# Random spread applied to each interval (+/- 10%), so that refreshes do not all fire at the same time
+PREWARM_JITTER = float(os.getenv('PREWARM_JITTER', 0.1))
+
+# Maximum number of refreshes started per club over a rolling hour
+PREWARM_CLUB_BUDGET_PER_HOUR = int(os.getenv('PREWARM_CLUB_BUDGET_PER_HOUR', 40))
+
+# Time between two passes of the scheduler, in seconds
+PREWARM_TICK_SECONDS = float(os.getenv('PREWARM_TICK_SECONDS', 30))
+
+
+def refresh_interval(days_ahead: int, intervals: list = PREWARM_INTERVALS) -> timedelta:
+    """
+    Refresh interval of a date that is {days_ahead} days after today.
+    """
+    for last_day, minutes in intervals:
+        if last_day is None or days_ahead <= last_day:
+            return timedelta(minutes= minutes)
+    return timedelta(minutes= intervals[-1][1])
+
+
+class PrewarmScheduler:
+    """
+    In-process scheduler keeping the next {horizon_days} days of every club warm.
+    Each (club, date) is refreshed through the refresh coordinator once its next due time is reached,
+    within a per-club budget of refreshes per rolling hour. Due pairs that exceed the budget stay queued
+    until the budget frees up, the most overdue first.
+    """
+
+    def __init__(self,
+                 mongodb_client: AsyncMongoClient,
+                 clubs: Iterable[str] | None = None,
+                 horizon_days: int = PREWARM_HORIZON_DAYS,
+                 intervals: list = PREWARM_INTERVALS,
+                 jitter: float = PREWARM_JITTER,
+                 club_budget_per_hour: int = PREWARM_CLUB_BUDGET_PER_HOUR,
+                 tick_seconds: float = PREWARM_TICK_SECONDS,
+                 coordinator: RefreshCoordinator = refresh_coordinator):
+        self.mongodb_client = mongodb_client
+        self.clubs = list(clubs or SCRAPERS)
+        self.horizon_days = horizon_days
+        self.intervals = intervals
+        self.jitter = jitter
+        self.club_budget_per_hour = club_budget_per_hour
+        self.tick_seconds = tick_seconds
+        self.coordinator = coordinator
+        self._next_due: Dict[Tuple[str, date], datetime] = {}
+        self._spent: Dict[str, deque] = {club: deque() for club in self.clubs}
+        self._task: asyncio.Task | None = None
+        self.last_tick: datetime | None = None
+
+    def _now(self) -> datetime:
+        return datetime.now(ZoneInfo("Indian/Reunion"))
+
+    def _horizon(self, today: date) -> List[date]:
+        return date_range(today, today + timedelta(days= self.horizon_days - 1))
+
+    def _interval(self, availability_date: date, today: date) -> timedelta:
+        interval = refresh_interval((availability_date - today).days, self.intervals)
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _budget_left(self, club: str, now: datetime) -> int:
+        spent = self._spent[club]
+        while spent and spent[0] <= now - timedelta(hours= 1):
+            spent.popleft()
+        return self.club_budget_per_hour - len(spent)
+
+    async def seed(self):
+        """
+        Initialize the next due time of every (club, date) from the newest scrape already stored,
+        so that a restart does not scrape the whole horizon again.
+        """
+        now = self._now()
+        horizon = self._horizon(now.date())
+        newest_scrapes = await newest_scraping_datetimes(self.mongodb_client, self.clubs, horizon)
+        for (club, availability_date), newest in newest_scrapes.items():
+            self._next_due[(club, availability_date)] = newest + self._interval(availability_date, now.date()) if newest else now
+
+    def tick(self) -> int:
+        """
+        One pass of the scheduler: roll the horizon forward and start the refreshes that are due.
+
+        Returns:
+            - number of refreshes started (int)
+        """
+        now = self._now()
+        today = now.date()
+        self.last_tick = now
+
+        # Forget the past dates and add the dates entering the horizon
+        horizon = self._horizon(today)
+        for key in [key for key in self._next_due if key[1] < today]:
+            del self._next_due[key]
+        for club in self.clubs:
+            for availability_date in horizon:
+                self._next_due.setdefault((club, availability_date), now)
+
+        started = 0
+        for (club, availability_date), due in sorted(self._next_due.items(), key= lambda item: item[1]):
+            if due > now:
+                break
+            if self._budget_left(club, now) <= 0:
+                continue
+
+            self.coordinator.refresh(self.mongodb_client, club, availability_date)
+            self._spent[club].append(now)
+            self._next_due[(club, availability_date)] = now + self._interval(availability_date, today)
+            started += 1
+
+        return started
+
+    async def run(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f'Pre-warm scheduler pass failed: {e!r}')
+            await asyncio.sleep(self.tick_seconds)
+
+    async def start(self):
+        try:
+            await self.seed()
+        except Exception as e:
+            print(f'Pre-warm scheduler could not be seeded from the database, every date is due: {e!r}')
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions= True)
+            self._task = None
+
+    def snapshot(self) -> dict:
+        """
+        Queue state: next due time of every (club, date), and budget left per club.
+        """
+        now = self._now()
+        in_flight = {(job['club'], job['availability_date']) for job in self.coordinator.in_flight()}
+        queue = [
+            {
+                'club': club,
+                'availability_date': availability_date,
+                'next_due': due,
+                'overdue': due <= now,
+                'in_flight': (club, availability_date) in in_flight,
+            }
+            for (club, availability_date), due in sorted(self._next_due.items(), key= lambda item: item[1])
+        ]
+        return {
+            'running': self._task is not None and not self._task.done(),
+            'last_tick': self.last_tick,
+            'horizon_days': self.horizon_days,
+            'budget_left': {club: self._budget_left(club, now) for club in self.clubs},
+            'queue': queue,
+        }
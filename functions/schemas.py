@@ -1,6 +1,6 @@
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, ConfigDict, Field, StrictInt, StrictStr, model_validator
 from datetime import date, time, datetime
-from typing import List
+from typing import List, Literal
 
 # Define the schema for an available slot, to be inserted into MongoDB
 
@@ -22,20 +22,92 @@ class AvailabilityRead(BaseModel):
     availability_date: date
     availability_time: time | None = None
     availability_duration: int | None = None
+    # Range search: slots starting at or after time_from, ending at or before time_to, lasting at least min_duration
+    time_from: time | None = None
+    time_to: time | None = None
+    min_duration: int | None = None
+
+    @model_validator(mode = 'after')
+    def time_window_is_ordered(self):
+        if self.time_from is not None and self.time_to is not None and self.time_to <= self.time_from:
+            raise ValueError('time_to must be after time_from')
+        return self
     
-class AvailabilityDelete(BaseModel):
+class FreeWindowRead(BaseModel):
     region: List[str] | None = None
     city: List[str] | None = None
     club: List[str] | None = None
     court: List[str] | None = None
     availability_date: date
+    # Part of the day searched: windows overlapping [time_from, time_to] are returned, clipped to it
+    time_from: time | None = None
+    time_to: time | None = None
+    min_duration: int | None = None
 
-    @model_validator(mode = 'before')
-    @classmethod
-    def at_least_one_not_none(cls, values):
-        pass
-        # if not any(values.)
+    @model_validator(mode = 'after')
+    def time_window_is_ordered(self):
+        if self.time_from is not None and self.time_to is not None and self.time_to <= self.time_from:
+            raise ValueError('time_to must be after time_from')
+        return self
 
+class PageKey(BaseModel):
+    # Keyset of the last document of a page, decoded from a client token: exactly the fields of crud.PAGE_KEY_FIELDS,
+    # with scalar values only, since they are copied into the MongoDB filter of the next page
+    model_config = ConfigDict(extra= 'forbid')
 
-    
+    availability_date: date
+    availability_time: time
+    club: StrictStr
+    court: StrictStr
+    availability_duration: StrictInt
+
+class AvailabilityDelete(BaseModel):
+    region: List[str] | None = None
+    city: List[str] | None = None
+    club: List[str] | None = None
+    court: List[str] | None = None
+    availability_date: date | None = None
+    availability_date_before: date | None = None
+
+    @model_validator(mode = 'after')
+    def at_least_one_not_none(self):
+        # An empty delete filter would wipe the whole collection
+        if not any(value not in (None, []) for value in self.model_dump().values()):
+            raise ValueError('At least one filter is required to delete availabilities')
+        return self
 
+
+# Define the schema of the WhatsApp webhook payloads, limited to the fields read by whatsapp.extract_messages.
+# Other fields (contacts, statuses, metadata...) are ignored
+
+class WhatsAppText(BaseModel):
+    body: StrictStr = ''
+
+class WhatsAppMessage(BaseModel):
+    id: StrictStr
+    sender: StrictStr = Field(alias= 'from')
+    type: StrictStr
+    text: WhatsAppText | None = None
+
+class WhatsAppValue(BaseModel):
+    messages: List[WhatsAppMessage] = []
+
+class WhatsAppChange(BaseModel):
+    value: WhatsAppValue = WhatsAppValue()
+
+class WhatsAppEntry(BaseModel):
+    changes: List[WhatsAppChange] = []
+
+class WhatsAppWebhook(BaseModel):
+    entry: List[WhatsAppEntry] = []
+
+
+# Define the schema for the outcome of a single (club, date) scraping job
+
+class ScrapeJobResult(BaseModel):
+    club: str
+    availability_date: date
+    status: Literal['success', 'unchanged', 'failed', 'timeout', 'skipped']
+    error: str | None = None
+    duration_seconds: float | None = None
+    availabilities: List[AvailabilityCreate] = []
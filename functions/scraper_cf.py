@@ -1,50 +1,57 @@
-import time
-import re
+import os
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import schemas
-import requests
-from bs4 import BeautifulSoup
+import httpx
+from extractors import extract_champ_fleuri_page, extract_select_slots
+from normalize import normalize_slots
 from typing import List
 from database import instantiate_mongodb_client
-from crud import insert_availabilities
+from crud import replace_availabilities
+from sessions import ClubSession, session_cache, is_session_expired
+from metrics import span
+from resilience import ScraperError, request_with_retries
+from workers import parse_pool
 import asyncio
     
 
-def scrape_champ_fleuri(username:str, password:str, selected_date: str) -> List[schemas.AvailabilityCreate]:
+# Root of the club website, overridden to point the scraper at a local stand-in (see benchmarks/)
+CHAMP_FLEURI_BASE_URL = os.getenv('CHAMP_FLEURI_BASE_URL', 'https://tennispadelchampfleuri.re')
+
+LOGIN_URL = f"{CHAMP_FLEURI_BASE_URL}/login"
+AVAILABILITIES_URL = f"{CHAMP_FLEURI_BASE_URL}/user/disponibilites"
+LIVEWIRE_UPDATE_URL = f"{CHAMP_FLEURI_BASE_URL}/livewire/update"
+CLUB = 'Champ-Fleuri'
+
+
+async def login_champ_fleuri(client: httpx.AsyncClient, username:str, password:str) -> ClubSession:
     """
-    Scraper for court availabilities at Champ-Fleuri.
-    
+    Full login flow at Champ-Fleuri: CSRF token of the login page, credentials, then CSRF token and
+    Livewire snapshot of the availabilities dashboard.
+
     Parameters:
+        - client (httpx.AsyncClient): Client used to send the requests, it keeps the login cookies
         - username (str): Username used to login to https://tennispadelchampfleuri.re/login
-        - password (str): Username used to login to https://tennispadelchampfleuri.re/login
-        - selected_date (str): Date for which you want to scrape availabilities, in the format 'DD/MM/YYYY'
-    
+        - password (str): Password used to login to https://tennispadelchampfleuri.re/login
+
     Returns:
-        - list of court availabilities (List[schemas.AvailabilityCreate]) : A list of availabilities, in the format defined by the pydantic model in schemas.AvalabilityCreate 
-    
+        - authenticated session (ClubSession) : cookies, CSRF token and snapshot to reuse for the Livewire updates
+
+    Raises:
+        - httpx.HTTPError : if a request of the login flow failed
+        - ScraperError : if a page of the login flow has no CSRF token
     """
-    
-    
-    LOGIN_URL = "https://tennispadelchampfleuri.re/login"
-    AVAILABILITIES_URL = "https://tennispadelchampfleuri.re/user/disponibilites"  
-    session = requests.Session()
 
     # GET login page to obtain cookies + CSRF token
-    try:
-        response = session.get(LOGIN_URL, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-    except requests.exceptions.HTTPError as e:
-        print("Request failed:", e)
-        
-
-    csrf_meta = soup.find("meta", attrs={"name": "csrf-token"})["content"]
-    csrf_input = soup.find("input", {"name": "_token"})
-    csrf_token = csrf_input["value"] if csrf_input else csrf_meta["content"]
+    response = await request_with_retries(client, 'GET', LOGIN_URL, 'login', CLUB)
+    response.raise_for_status()
+    page = extract_champ_fleuri_page(response.text)
+
+    csrf_token = page.csrf_token
+    if not csrf_token:
+        raise ScraperError(f'No CSRF token in the {CLUB} login page')
     
     print("CSRF token:", csrf_token)
-    time.sleep(1)
     
     # Log in
     payload = {
@@ -69,49 +76,34 @@ def scrape_champ_fleuri(username:str, password:str, selected_date: str) -> List[
         "sec-ch-ua-platform": "\"Windows\"",
     }
     
-    login_response = session.post(LOGIN_URL, data=payload, headers=headers)
-    try:
-        login_response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        print("Login request failed:", e)
-        
-    time.sleep(1)
+    login_response = await request_with_retries(client, 'POST', LOGIN_URL, 'login', CLUB, data=payload, headers=headers)
+    login_response.raise_for_status()
     
     # Onced logged in, send a get request to the dashboard page to get a new csrf token used to make a reservation
-    availabilities_response = session.get(AVAILABILITIES_URL, timeout=15)
-    try: 
-        availabilities_response.raise_for_status()
-        soup = BeautifulSoup(availabilities_response.text, "html.parser")
-    except requests.exceptions.HTTPError as e:
-        print("Avalabilities request failed:", e)
-        
-
-    csrf_meta = soup.find("meta", attrs={"name": "csrf-token"})["content"]
-    csrf_input = soup.find("input", {"name": "_token"})
-    csrf_token = csrf_input["value"] if csrf_input else csrf_meta["content"]
+    availabilities_response = await request_with_retries(client, 'GET', AVAILABILITIES_URL, 'login', CLUB)
+    availabilities_response.raise_for_status()
+    ## The same pass also retrieves the page snapshot that will be reused in the livewire update
+    page = extract_champ_fleuri_page(availabilities_response.text)
+    if not page.csrf_token:
+        raise ScraperError(f'No CSRF token in the {CLUB} availabilities page')
 
-    print("CSRF token:", csrf_token)
-    time.sleep(1.5)
+    print("CSRF token:", page.csrf_token)
 
-    ## Also retrieve and parse the page snapshot that will be reused in the livewire update
-    snapshot_divs = soup.find_all("div", attrs={"wire:snapshot": True})
+    return ClubSession(
+        cookies= {cookie.name: cookie.value for cookie in client.cookies.jar},
+        csrf_token= page.csrf_token,
+        snapshot= page.snapshot
+    )
 
-    snapshot_length = 0
-    longest_snapshot = None
-    for element in snapshot_divs:
-        snapshot = element["wire:snapshot"]
-        if len(snapshot) >= snapshot_length:
-            longest_snapshot = snapshot
-            snapshot_length = len(snapshot)
+
+async def send_livewire_update(client: httpx.AsyncClient, club_session: ClubSession, selected_date: str) -> httpx.Response:
+    """
+    Ask the Livewire availabilities component to render the padel slots of {selected_date}.
+    """
 
     ### Update sport and selected_date
     sport_str = 'padel'
 
-    cookies = {
-        'XSRF-TOKEN': session.cookies.get('XSRF-TOKEN'),
-        'tennis_et_padel_champ_fleuri_session': session.cookies.get('tennis_et_padel_champ_fleuri_session')
-    }
-
     headers = {
         'Accept': '*/*',
         'Accept-Language': 'fr,en-US;q=0.9,en;q=0.8',
@@ -129,10 +121,10 @@ def scrape_champ_fleuri(username:str, password:str, selected_date: str) -> List[
     }
 
     json_data = {
-        '_token': csrf_token,
+        '_token': club_session.csrf_token,
         'components': [
             {
-                'snapshot': longest_snapshot,
+                'snapshot': club_session.snapshot,
                 'updates': {
                     'typeSport': sport_str,
                     'bookingDate': selected_date
@@ -142,56 +134,98 @@ def scrape_champ_fleuri(username:str, password:str, selected_date: str) -> List[
         ],
     }
 
-    update_response = session.post('https://tennispadelchampfleuri.re/livewire/update', cookies=cookies, headers=headers, json=json_data, timeout = 10)
-    try: 
-        update_response.raise_for_status()
+    return await request_with_retries(client, 'POST', LIVEWIRE_UPDATE_URL, 'fetch', CLUB,
+                                      headers=headers, json=json_data, follow_redirects= False)
+
+
+def parse_champ_fleuri(html_string: str, selected_date: str, scraping_datetime: datetime) -> List[schemas.AvailabilityCreate]:
+    """
+    Parse and validate stage of the Champ-Fleuri scraper, run on the parse pool.
 
-    except requests.exceptions.HTTPError as e:
-        print("Update request failed:", e)
+    Parameters:
+        - html_string (str): HTML rendered by the Livewire availabilities component
+        - selected_date (str): Date of the slots, in the format 'DD/MM/YYYY'
+        - scraping_datetime (datetime): Time of the scrape, shared by every slot
+    """
+    region = "Nord"
+    city = 'Saint-Denis'
+    club = CLUB
+
+    # Champ-Fleuri lists every bookable duration of a slot, only the longest one is kept
+    raw_slots = [(court, start, max(list_of_durations))
+                 for court, start, list_of_durations in extract_select_slots(html_string)]
+
+    return normalize_slots(raw_slots, region, city, club, selected_date, scraping_datetime)
+
+
+async def scrape_champ_fleuri(username:str, password:str, selected_date: str) -> List[schemas.AvailabilityCreate]:
+    """
+    Scraper for court availabilities at Champ-Fleuri.
+    The authenticated session is taken from the session cache when available, so a full login only happens
+    on the first call for an account or once the cached session has expired.
     
+    Parameters:
+        - username (str): Username used to login to https://tennispadelchampfleuri.re/login
+        - password (str): Username used to login to https://tennispadelchampfleuri.re/login
+        - selected_date (str): Date for which you want to scrape availabilities, in the format 'DD/MM/YYYY'
+    
+    Returns:
+        - list of court availabilities (List[schemas.AvailabilityCreate]) : A list of availabilities, in the format defined by the pydantic model in schemas.AvalabilityCreate 
+
+    Raises:
+        - httpx.HTTPError : if a request still failed after its retries, the job is then reported as failed
+    """
+    
+    async with httpx.AsyncClient(follow_redirects= True) as client:
+
+        async with session_cache.async_login_lock(CLUB, username):
+            club_session = session_cache.get(CLUB, username)
+            if club_session is None:
+                club_session = await login_champ_fleuri(client, username, password)
+                session_cache.set(CLUB, username, club_session)
+            else:
+                client.cookies.update(club_session.cookies)
+
+        update_response = await send_livewire_update(client, club_session, selected_date)
+
+        # Log in again only if the cached session has expired
+        if is_session_expired(update_response, '/login'):
+            print(f'Session expired for {username} at {CLUB}, logging in again...')
+            expired_session = club_session
+            session_cache.invalidate(CLUB, username, expired_session)
+            client.cookies.clear()
+            async with session_cache.async_login_lock(CLUB, username):
+                # A concurrent job may have logged in again while this one was waiting for the lock
+                club_session = session_cache.get(CLUB, username)
+                if club_session is None or club_session is expired_session:
+                    club_session = await login_champ_fleuri(client, username, password)
+                    session_cache.set(CLUB, username, club_session)
+                else:
+                    client.cookies.update(club_session.cookies)
+            update_response = await send_livewire_update(client, club_session, selected_date)
 
+        update_response.raise_for_status()
     
+        # Keep the refreshed cookies and snapshot for the next call. The cached session is never mutated:
+        # concurrent jobs may be reading it, so a new one takes its place, unless a re-login already replaced it
+        component = update_response.json()['components'][0]
+        session_cache.replace(CLUB, username, club_session,
+                              ClubSession(cookies= {cookie.name: cookie.value for cookie in client.cookies.jar},
+                                          csrf_token= club_session.csrf_token,
+                                          snapshot= component.get('snapshot', club_session.snapshot),
+                                          created_at= club_session.created_at))
+
     ### Retrieve available time slots ###
     scraping_datetime = datetime.now(ZoneInfo("Indian/Reunion"))
-    region = "Nord"
-    city = 'Saint-Denis'
-    club = 'Champ-Fleuri'
-    output = []
-    
-    html_string = update_response.json()['components'][0]['effects']['html']
-    html = BeautifulSoup(html_string,"html.parser")
-    buttons = html.find_all("button", attrs={"@click": re.compile(r"selectSlot")})
-
-    for btn in buttons:
-        click_attr = btn.get("@click")
-        match = re.search(r"selectSlot\((.*?)\)", click_attr)
-        string_to_parse = match.group(1)
-        list_to_parse = string_to_parse.split(', ')
-        
-        court = list_to_parse[0].strip("'")
-        availability_time = datetime.strptime(list_to_parse[1].strip("'"), "%H:%M").time()
-        list_of_durations = [int(x) for x in list_to_parse[2].strip("[]").split(",")]
-        max_duration = max(list_of_durations)
-        
-        output.append(schemas.AvailabilityCreate(
-            scraping_datetime= scraping_datetime,
-            region= region,
-            city= city,
-            club= club,
-            court= court,
-            availability_date= datetime.strptime(selected_date, "%d/%m/%Y"),
-            availability_time= availability_time,
-            availability_duration= max_duration 
-        ))
-        
-    return output
+    with span('scraper.parse', club= CLUB):
+        return await parse_pool.run(parse_champ_fleuri, component['effects']['html'], selected_date, scraping_datetime)
     
 
 
 async def main_insert():
-    available_slots = scrape_champ_fleuri(args.username, args.password, args.date)
-    await insert_availabilities(instantiate_mongodb_client(args.mongodb_user, args.mongodb_password),
-                          available_slots)
+    available_slots = await scrape_champ_fleuri(args.username, args.password, args.date)
+    async with instantiate_mongodb_client(args.mongodb_user, args.mongodb_password) as client:
+        await replace_availabilities(client, CLUB, datetime.strptime(args.date, "%d/%m/%Y").date(), available_slots)
 
 
 if __name__ == '__main__':
@@ -1,28 +1,88 @@
-import time
+import os
+import json
+import threading
 import schemas
-import requests
-from datetime import datetime
+import httpx
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from typing import List
+from typing import Dict, List, Tuple
 from database import instantiate_mongodb_client
-from crud import insert_availabilities
+from crud import replace_availabilities
+from normalize import normalize_slots
+from metrics import span
+from resilience import request_with_retries
+from workers import parse_pool
 import asyncio
 
 
-def scrape_oasis(username:str = None, password:str = None, selected_date: str = None) -> List[schemas.AvailabilityCreate]:
-    
+CLUB = 'Oasis'
+
+# Root of the planning API, overridden to point the scraper at a local stand-in (see benchmarks/)
+OASIS_API_URL = os.getenv('OASIS_API_URL', 'https://api-v3.doinsport.club')
+
+# Validators of the last planning downloaded for each date: {selected_date : (etag, downloaded_at, parsed slots)}
+# An entry older than OASIS_VALIDATOR_MAX_AGE_HOURS is ignored, so that the stored snapshot is rewritten
+# (and its expires_at pushed forward) at least that often even when the planning never changes
+PLANNING_CACHE: Dict[str, Tuple[str, datetime, List[schemas.AvailabilityCreate]]] = {}
+PLANNING_CACHE_LOCK = threading.Lock()
+OASIS_VALIDATOR_MAX_AGE_HOURS = float(os.getenv('OASIS_VALIDATOR_MAX_AGE_HOURS', 24))
+
+
+def parse_oasis(payload: bytes, selected_date: str, scraping_datetime: datetime) -> List[schemas.AvailabilityCreate]:
+    """
+    Parse and validate stage of the Oasis scraper, run on the parse pool.
+
+    Parameters:
+        - payload (bytes): Raw JSON planning returned by the API
+        - selected_date (str): Date of the slots, in the format 'DD/MM/YYYY'
+        - scraping_datetime (datetime): Time of the scrape, shared by every slot
+    """
     solpak = {"name": "Padel 1 - SOLPAK",
           "id": "21185ff2-c3cc-4f93-b3b4-eac9070dd8f6"}
     porsche = {"name": "Padel 2 - PORSCHE",
                 "id" : "836d44ae-692f-4fd0-80ff-5a050762c3f1"}
     caprice = {"name": "Padel 3 - CAPRICE",
             "id": "9e678e91-72a4-4ffe-8f00-a1f0d64f6f52"}
+
+    json_to_parse = json.loads(payload)
+    region = "Ouest"
+    city = 'Saint-Paul'
+    club = CLUB
+    raw_slots = []
+
+    for playground in json_to_parse['hydra:member']:
+        if playground['name'] in (solpak['name'], porsche['name'], caprice['name']):
+            for activity in playground.get("activities", []):
+                for slot in activity["slots"]:
+                    for price in slot["prices"]:
+                        if price['bookable']:
+                            raw_slots.append((playground['name'], slot["startAt"], price['duration'] // 60))
+
+    return normalize_slots(raw_slots, region, city, club, selected_date, scraping_datetime)
+
+
+async def scrape_oasis(username:str = None, password:str = None, selected_date: str = None, only_if_changed: bool = False) -> List[schemas.AvailabilityCreate] | None:
+    """
+    Scraper for court availabilities at Oasis.
+    The planning is requested with the ETag of the last planning downloaded for the same date: when the API answers
+    304 Not Modified, the slots parsed last time are reused instead of downloading and parsing the payload again.
     
-    session = requests.Session()
+    Parameters:
+        - username (str): Not used, the Oasis planning API is public
+        - password (str): Not used, the Oasis planning API is public
+        - selected_date (str): Date for which you want to scrape availabilities, in the format 'DD/MM/YYYY'
+        - only_if_changed (bool): Return None instead of the cached slots when the planning has not changed,
+          so that the caller can skip writing them again
     
+    Returns:
+        - list of court availabilities (List[schemas.AvailabilityCreate]) : A list of availabilities, in the format defined by the pydantic model in schemas.AvalabilityCreate,
+          or None if {only_if_changed} is set and the planning has not changed
+
+    Raises:
+        - httpx.HTTPError : if the planning request still failed after its retries
+    """
     
     ### Scrape availabilities ### 
-    today = datetime.today().strftime("%d/%m/%Y")
     selected_date_formated = datetime.strftime(
         datetime.strptime(selected_date, "%d/%m/%Y"),
         "%Y-%m-%d"
@@ -31,7 +91,6 @@ def scrape_oasis(username:str = None, password:str = None, selected_date: str =
     headers = {
         'accept': 'application/json, text/plain, */*',
         'accept-language': 'fr,en-US;q=0.9,en;q=0.8',
-        'if-none-match': '"d7bac161e4a2ab87817b85651de80790"',
         'origin': 'https://oasis-padel.doinsport.club',
         'priority': 'u=1, i',
         'referer': 'https://oasis-padel.doinsport.club/',
@@ -45,43 +104,51 @@ def scrape_oasis(username:str = None, password:str = None, selected_date: str =
         'x-locale': 'fr',
     }
 
-    response = session.get(f'https://api-v3.doinsport.club/clubs/playgrounds/plannings/{selected_date_formated}?club.id=3ddfa83f-19dc-4ff5-b2c1-2543eb1556a4&from=04:00&to=23:29:00&activities.id=8ee9b629-c5b1-4fd5-a680-51b1288e2527&bookingType=unique', headers=headers)
+    # Send the validator of the last planning downloaded for this date, if it is recent enough
+    with PLANNING_CACHE_LOCK:
+        cached = PLANNING_CACHE.get(selected_date)
+    if cached and datetime.now(ZoneInfo("Indian/Reunion")) - cached[1] < timedelta(hours= OASIS_VALIDATOR_MAX_AGE_HOURS):
+        headers['if-none-match'] = cached[0]
+    else:
+        cached = None
+
+    async with httpx.AsyncClient() as client:
+        response = await request_with_retries(client, 'GET', f'{OASIS_API_URL}/clubs/playgrounds/plannings/{selected_date_formated}?club.id=3ddfa83f-19dc-4ff5-b2c1-2543eb1556a4&from=04:00&to=23:29:00&activities.id=8ee9b629-c5b1-4fd5-a680-51b1288e2527&bookingType=unique', 'fetch', CLUB, headers=headers)
+
+    # httpx treats 304 as an error status, so Not Modified is handled before raise_for_status
+    if response.status_code == 304 and cached:
+        print(f'Oasis planning of the {selected_date} has not changed')
+        if only_if_changed:
+            return None
+        scraping_datetime = datetime.now(ZoneInfo("Indian/Reunion"))
+        return [slot.model_copy(update= {'scraping_datetime': scraping_datetime}) for slot in cached[2]]
+
     response.raise_for_status()
-    response.status_code
-    json_to_parse = response.json()
-    time.sleep(1.5)
-    
+
     ### Retrieve available time slots ###
     scraping_datetime = datetime.now(ZoneInfo("Indian/Reunion"))
-    region = "Ouest"
-    city = 'Saint-Paul'
-    club = 'Oasis'
-    output = []
+    with span('scraper.parse', club= CLUB):
+        output = await parse_pool.run(parse_oasis, response.content, selected_date, scraping_datetime)
+
+    etag = response.headers.get('etag')
+    with PLANNING_CACHE_LOCK:
+        if etag:
+            PLANNING_CACHE[selected_date] = (etag, scraping_datetime, output)
+        else:
+            PLANNING_CACHE.pop(selected_date, None)
+
+        # Forget the validators that can no longer be used
+        for expired_date in [d for d, (_, downloaded_at, _) in PLANNING_CACHE.items()
+                             if scraping_datetime - downloaded_at >= timedelta(hours= OASIS_VALIDATOR_MAX_AGE_HOURS)]:
+            del PLANNING_CACHE[expired_date]
 
-    for playground in json_to_parse['hydra:member']:
-        if playground['name'] in (solpak['name'], porsche['name'], caprice['name']):
-            for activity in playground.get("activities", []):
-                for slot in activity["slots"]:
-                    availability_time = datetime.strptime(slot["startAt"], "%H:%M").time()
-                    for price in slot["prices"]:
-                        if price['bookable']:
-                            output.append(schemas.AvailabilityCreate(
-                                scraping_datetime= scraping_datetime,
-                                region= region,
-                                city= city,
-                                club= club,
-                                court= playground['name'],
-                                availability_date= datetime.strptime(selected_date, "%d/%m/%Y"),
-                                availability_time= availability_time,
-                                availability_duration= price['duration'] // 60
-                            ))
     return output
                     
 
 async def main_insert():                   
-    available_slots = scrape_oasis(args.username, args.password, args.date)
-    await insert_availabilities(instantiate_mongodb_client(args.mongodb_user, args.mongodb_password),
-                          available_slots)    
+    available_slots = await scrape_oasis(args.username, args.password, args.date)
+    async with instantiate_mongodb_client(args.mongodb_user, args.mongodb_password) as client:
+        await replace_availabilities(client, CLUB, datetime.strptime(args.date, "%d/%m/%Y").date(), available_slots)    
         
 if __name__ == '__main__':
     import argparse
@@ -93,7 +160,5 @@ if __name__ == '__main__':
     parser.add_argument("--mongodb_password", type=str, help="The password for the mongodb database")
     
     args = parser.parse_args()
-    
-    available_slots = scrape_oasis(args.username, args.password, args.date)
 
     asyncio.run(main_insert())   
\ No newline at end of file
@@ -1,35 +1,91 @@
 from typing import List
+import json
 import schemas
-import requests
-import time
+import httpx
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import asyncio
+import os
 from database import instantiate_mongodb_client
-from crud import insert_availabilities
+from crud import replace_availabilities
+from normalize import normalize_slots
+from sessions import ClubSession, SessionExpired, session_cache, is_session_expired
+from metrics import span
+from resilience import ScraperError, request_with_retries
+from workers import parse_pool
 
 
+# Root of the club website, overridden to point the scraper at a local stand-in (see benchmarks/)
+TCD_BASE_URL = os.getenv('TCD_BASE_URL', 'https://dpr.gestion-sports.com')
 
+LOGIN_URL = f'{TCD_BASE_URL}/traitement/connexion.php?'
+BOOKING_URL = f'{TCD_BASE_URL}/membre/reservation.html'
+CLUB = 'TCD'
 
-def scrape_tcd(username:str, password:str, selected_date: str) -> List[schemas.AvailabilityCreate]:
+# Maximum number of loadCourtDispo requests sent at the same time to dpr.gestion-sports.com
+# (one per 2h window by default, so that a whole date is fetched in a single round trip)
+MAX_CONCURRENT_REQUESTS = 9
+
+BOOKING_HEADERS = {
+    'Accept': 'application/json, text/javascript, */*; q=0.01',
+    'Accept-Language': 'fr,en-US;q=0.9,en;q=0.8',
+    'Connection': 'keep-alive',
+    'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+    'Origin': 'https://dpr.gestion-sports.com',
+    'Referer': 'https://dpr.gestion-sports.com/membre/reservation.html',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-origin',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36',
+    'sec-ch-ua': '"Google Chrome";v="141", "Not?A_Brand";v="8", "Chromium";v="141"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+}
+
+
+async def load_court_dispo(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, selected_date: str, hour: str):
     """
-    Scraper for court availabilities at TCD.
-    
-    Parameters:
-        - username (str): Username used to login to https://dpr.gestion-sports.com/connexion.php?
-        - password (str): Username used to login to https://dpr.gestion-sports.com/connexion.php?
-        - selected_date (str): Date for which you want to scrape availabilities, in the format 'DD/MM/YYYY'
-    
+    Send a single loadCourtDispo request for a 2h window, waiting for a free slot in the semaphore first.
+
     Returns:
-        - list of court availabilities (List[schemas.AvailabilityCreate]) : A list of availabilities, in the format defined by the pydantic model in schemas.AvalabilityCreate 
-    
+        - payload (bytes) : The raw JSON payload, decoded by the parse stage
+
+    Raises:
+        - SessionExpired : if the website answered as if the session was logged out
+        - httpx.HTTPError : if the request still failed after its retries
     """
-    
-    LOGIN_URL = 'https://dpr.gestion-sports.com/traitement/connexion.php?'
-    BOOKING_URL = 'https://dpr.gestion-sports.com/membre/reservation.html'
-    
-    session = requests.Session()
-    
+
+    payload = {
+        'ajax': 'loadCourtDispo',
+        'idSport': '885',
+        'date' : selected_date,
+        'hour' : hour
+    }
+
+    async with semaphore:
+        print(f'Scraping availabilities on the {selected_date} at {hour}...')
+        booking_resp = await request_with_retries(client, 'POST', BOOKING_URL, 'fetch', CLUB, data=payload, headers=BOOKING_HEADERS)
+        if is_session_expired(booking_resp, 'connexion'):
+            raise SessionExpired(f'TCD session expired while loading {hour}')
+        booking_resp.raise_for_status()
+        response = booking_resp.content
+
+    print(f'Request successful for hour {hour}')
+    return response
+
+
+async def login_tcd(client: httpx.AsyncClient, username:str, password:str) -> ClubSession:
+    """
+    Full login flow at TCD: GET the login page for the session cookies, then POST the credentials.
+
+    Returns:
+        - authenticated session (ClubSession) : cookies to reuse for the loadCourtDispo requests
+
+    Raises:
+        - httpx.HTTPError : if a request of the login flow failed
+        - ScraperError : if the website refused the credentials
+    """
+
     # 1) GET login page to obtain cookies and CSRF token
     headers = {
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
@@ -47,14 +103,9 @@ def scrape_tcd(username:str, password:str, selected_date: str) -> List[schemas.A
         'sec-ch-ua-platform': '"Windows"',
     }
 
-    try:
-        resp = session.get(LOGIN_URL, headers= headers, timeout=10)
-        resp.raise_for_status()  
-    except requests.exceptions.HTTPError as e:
-        print("HTTP error occurred on first login:", e)  
-    
-    time.sleep(3)
-    
+    resp = await request_with_retries(client, 'GET', LOGIN_URL, 'login', CLUB, headers= headers)
+    resp.raise_for_status()
+
     # Log in
     payload = {
         'ajax' : 'connexionUser',
@@ -67,7 +118,7 @@ def scrape_tcd(username:str, password:str, selected_date: str) -> List[schemas.A
         'identifiant' : 'identifiant',
         'externCo' : True
     }
-    
+
     headers = {
         'Accept': 'application/json, text/javascript, */*; q=0.01',
         'Accept-Language': 'fr,en-US;q=0.9,en;q=0.8',
@@ -83,89 +134,137 @@ def scrape_tcd(username:str, password:str, selected_date: str) -> List[schemas.A
         'sec-ch-ua-mobile': '?0',
         'sec-ch-ua-platform': '"Windows"',
        }
-    
+
+    password_login_resp = await request_with_retries(client, 'POST', LOGIN_URL, 'login', CLUB, data=payload, headers=headers)
+    password_login_resp.raise_for_status()
+
+    # A refused login is still answered with a 200, the outcome is in the JSON body
     try:
-        password_login_resp = session.post(LOGIN_URL, data=payload, headers=headers)
-        password_login_resp.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        print("HTTP error occurred on second login:", e)  
-        
-    time.sleep(3)
-    
-    # Booking
-    ## Iterating over multiples hours to retrieve all possible availabilities
-    ## for a given availability date
-    scraping_datetime = datetime.now(ZoneInfo("Indian/Reunion"))
+        login_result = password_login_resp.json()
+    except ValueError:
+        raise ScraperError(f'{CLUB} login answer is not JSON')
+    if not isinstance(login_result, dict) or login_result.get('status') != 'ok':
+        message = login_result.get('msg') if isinstance(login_result, dict) else None
+        raise ScraperError(f'{CLUB} login refused for {username}: {message or login_result!r}')
+
+    return ClubSession(cookies= {cookie.name: cookie.value for cookie in client.cookies.jar})
+
+
+def parse_tcd(payloads: List[bytes], hours: List[str], selected_date: str, scraping_datetime: datetime) -> List[schemas.AvailabilityCreate]:
+    """
+    Parse and validate stage of the TCD scraper, run on the parse pool.
+
+    Parameters:
+        - payloads (List[bytes]): Raw loadCourtDispo answers of the 2h windows
+        - hours (List[str]): Start of the window of each payload, for the error messages
+        - selected_date (str): Date of the slots, in the format 'DD/MM/YYYY'
+        - scraping_datetime (datetime): Time of the scrape, shared by every slot
+
+    Raises:
+        - ScraperError : if a payload is not JSON
+    """
     region = "Nord"
     city = 'Saint-Denis'
-    club = 'TCD'
-    hours = [f"{h:02d}:00" for h in range(6, 24, 2)]
-    output = []
+    club = CLUB
 
-    for hour in hours:
-        print(f'Scraping availabilities on the {selected_date} at {hour}...')
-        
-        payload = {
-            'ajax': 'loadCourtDispo',
-            'idSport': '885',
-            'date' : selected_date,
-            'hour' : hour
-        }
-
-        
-        headers = {
-            'Accept': 'application/json, text/javascript, */*; q=0.01',
-            'Accept-Language': 'fr,en-US;q=0.9,en;q=0.8',
-            'Connection': 'keep-alive',
-            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-            'Origin': 'https://dpr.gestion-sports.com',
-            'Referer': 'https://dpr.gestion-sports.com/membre/reservation.html',
-            'Sec-Fetch-Dest': 'empty',
-            'Sec-Fetch-Mode': 'cors',
-            'Sec-Fetch-Site': 'same-origin',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36',
-            'sec-ch-ua': '"Google Chrome";v="141", "Not?A_Brand";v="8", "Chromium";v="141"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"Windows"',
-        } 
-        
+    # The 2h windows overlap, so the same slot is usually returned by several windows
+    raw_slots = []
+    for hour, payload in zip(hours, payloads):
         try:
-            booking_resp = session.post(BOOKING_URL, data=payload, headers=headers)
-            booking_resp.raise_for_status()
-            response = booking_resp.json()
-        except requests.exceptions.HTTPError as e:
-            print("HTTP error occurred on booking request:", e) 
-        except requests.exceptions.JSONDecodeError as e:
-            print("JSONDecode error occurred on booking request:", e)  
-            
-        if booking_resp.status_code == 200:
-            print(f'Request successful for hour {hour}')
-            
-            for court in response:
-                for dispo in court['heuresDispo']:
-                    for duration in dispo['duration']:
-                        availability = schemas.AvailabilityCreate(
-                            scraping_datetime= scraping_datetime,
-                            region= region,
-                            city= city,
-                            club= club,
-                            court= court['name'],
-                            availability_date= datetime.strptime(selected_date, "%d/%m/%Y"),
-                            availability_time= dispo['hourStart'],
-                            availability_duration= duration['duration']
-                        )
-                        if availability not in output: 
-                            output.append(availability)
-            print(f'Availabilities successfully loaded for hour {hour}')
-            time.sleep(2)
-            
-    return output
+            courts = json.loads(payload)
+        except ValueError as e:
+            raise ScraperError(f'Availabilities of {hour} are not JSON: {e}')
+
+        for court in courts:
+            for dispo in court['heuresDispo']:
+                for duration in dispo['duration']:
+                    raw_slots.append((court['name'], dispo['hourStart'], duration['duration']))
+
+    return normalize_slots(raw_slots, region, city, club, selected_date, scraping_datetime)
+
+
+async def scrape_tcd(username:str, password:str, selected_date: str, max_concurrency: int = MAX_CONCURRENT_REQUESTS) -> List[schemas.AvailabilityCreate]:
+    """
+    Scraper for court availabilities at TCD.
+    The 2h windows of the selected date are requested concurrently, with at most {max_concurrency} requests in flight.
+    The authenticated session is taken from the session cache when available, so a full login only happens
+    on the first call for an account or once the cached session has expired.
+
+    Parameters:
+        - username (str): Username used to login to https://dpr.gestion-sports.com/connexion.php?
+        - password (str): Username used to login to https://dpr.gestion-sports.com/connexion.php?
+        - selected_date (str): Date for which you want to scrape availabilities, in the format 'DD/MM/YYYY'
+        - max_concurrency (int): Maximum number of simultaneous requests sent to dpr.gestion-sports.com
+
+    Returns:
+        - list of court availabilities (List[schemas.AvailabilityCreate]) : A list of availabilities, in the format defined by the pydantic model in schemas.AvalabilityCreate
+
+    Raises:
+        - httpx.HTTPError, ScraperError : if a 2h window could not be loaded. A partial date is never returned,
+          since writing it would delete the stored slots of the missing windows
+    """
+
+    limits = httpx.Limits(max_connections= max_concurrency, max_keepalive_connections= max_concurrency)
+
+    async with httpx.AsyncClient(limits= limits, follow_redirects= True) as client:
+
+        # Reuse the cached session of the account when there is one
+        async with session_cache.async_login_lock(CLUB, username):
+            club_session = session_cache.get(CLUB, username)
+            if club_session is None:
+                club_session = await login_tcd(client, username, password)
+                session_cache.set(CLUB, username, club_session)
+            else:
+                client.cookies.update(club_session.cookies)
+
+        # Booking
+        ## Requesting every 2h window of the availability date concurrently
+        scraping_datetime = datetime.now(ZoneInfo("Indian/Reunion"))
+        hours = [f"{h:02d}:00" for h in range(6, 24, 2)]
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        responses = await asyncio.gather(*[load_court_dispo(client, semaphore, selected_date, hour) for hour in hours],
+                                         return_exceptions= True)
+
+        # Log in again only if the cached session has expired, then retry the windows that were refused
+        expired_hours = [hour for hour, response in zip(hours, responses) if isinstance(response, SessionExpired)]
+        if expired_hours:
+            print(f'Session expired for {username} at {CLUB}, logging in again...')
+            expired_session = club_session
+            session_cache.invalidate(CLUB, username, expired_session)
+            client.cookies.clear()
+            async with session_cache.async_login_lock(CLUB, username):
+                # A concurrent job may have logged in again while this one was waiting for the lock
+                club_session = session_cache.get(CLUB, username)
+                if club_session is None or club_session is expired_session:
+                    club_session = await login_tcd(client, username, password)
+                    session_cache.set(CLUB, username, club_session)
+                else:
+                    client.cookies.update(club_session.cookies)
+
+            retried = await asyncio.gather(*[load_court_dispo(client, semaphore, selected_date, hour) for hour in expired_hours],
+                                           return_exceptions= True)
+            retried = dict(zip(expired_hours, retried))
+            responses = [retried.get(hour, response) for hour, response in zip(hours, responses)]
+
+        # Keep the refreshed cookies for the next call, in a new session rather than by mutating the shared one
+        session_cache.replace(CLUB, username, club_session,
+                              ClubSession(cookies= {cookie.name: cookie.value for cookie in client.cookies.jar},
+                                          created_at= club_session.created_at))
+
+    for hour, response in zip(hours, responses):
+        if isinstance(response, BaseException):
+            print(f'Availabilities could not be loaded for hour {hour}:', response)
+            raise response
+
+    with span('scraper.parse', club= CLUB):
+        return await parse_pool.run(parse_tcd, responses, hours, selected_date, scraping_datetime)
 
 
 async def main_insert():
-    available_slots = scrape_tcd(args.username, args.password, args.date)
-    await insert_availabilities(instantiate_mongodb_client(args.mongodb_user, args.mongodb_password),
-                          available_slots)
+    available_slots = await scrape_tcd(args.username, args.password, args.date, args.max_concurrency)
+    async with instantiate_mongodb_client(args.mongodb_user, args.mongodb_password) as client:
+        await replace_availabilities(client, CLUB, datetime.strptime(args.date, "%d/%m/%Y").date(), available_slots)
 
 if __name__ == '__main__':
     import argparse
@@ -173,10 +272,11 @@ if __name__ == '__main__':
     parser.add_argument("--username", type=str, required=True, help="The username of the CF account")
     parser.add_argument("--password", type=str, required=True, help="The password for the CF account")
     parser.add_argument("--date", type=str, required=True, help="The selected date in the format DD/MM/YYYY")
+    parser.add_argument("--max_concurrency", type=int, default=MAX_CONCURRENT_REQUESTS, help="The maximum number of simultaneous requests sent to the TCD website")
     parser.add_argument("--mongodb_user", type=str, help="The username for the mongodb database if data is to be inserted in a collection")
     parser.add_argument("--mongodb_password", type=str, help="The password for the mongodb database")
     args = parser.parse_args()
-    
+
     asyncio.run(main_insert())
-    
-    
\ No newline at end of file
+
+
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from typing import Dict, Tuple
+
+
+# Status codes returned by the club websites once the session cookies or the CSRF token are no longer valid
+# (419 is Laravel's "Page Expired")
+EXPIRED_STATUS_CODES = {401, 403, 419}
+
+
+class SessionExpired(Exception):
+    """Raised when a club website answers as if the cached session was logged out."""
+
+
+@dataclass
+class ClubSession:
+    """
+    Authenticated state of a club account, reused across scraping calls.
+
+    Attributes:
+        - cookies (dict): Session cookies returned by the club website
+        - csrf_token (str): CSRF token to send along with the data requests, if the website uses one
+        - snapshot (str): Latest Livewire snapshot of the availabilities component, if the website uses Livewire
+        - created_at (datetime): Time of the login that created the session
+    """
+    cookies: Dict[str, str]
+    csrf_token: str | None = None
+    snapshot: str | None = None
+    created_at: datetime = field(default_factory= lambda: datetime.now(ZoneInfo("Indian/Reunion")))
+
+
+class SessionCache:
+    """
+    In-memory cache of authenticated sessions, keyed by (club, account).
+    A session stays in the cache until a scraper detects it has expired and invalidates it.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[Tuple[str, str], ClubSession] = {}
+        self._lock = threading.Lock()
+        self._async_login_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    def get(self, club: str, account: str) -> ClubSession | None:
+        with self._lock:
+            return self._sessions.get((club, account))
+
+    def set(self, club: str, account: str, session: ClubSession):
+        with self._lock:
+            self._sessions[(club, account)] = session
+
+    def invalidate(self, club: str, account: str, session: ClubSession | None = None):
+        """
+        Drop the cached session of an account. When {session} is given, it is only dropped if it is still the cached one,
+        so that a session already replaced by a concurrent call is kept.
+        """
+        with self._lock:
+            if session is None or self._sessions.get((club, account)) is session:
+                self._sessions.pop((club, account), None)
+
+    def replace(self, club: str, account: str, session: ClubSession, new_session: ClubSession) -> bool:
+        """
+        Cache {new_session} in place of {session}, only if {session} is still the cached one: a session
+        refreshed after a request never overwrites a newer login made by a concurrent call.
+
+        Returns:
+            - replaced (bool) : whether {new_session} is now the cached session
+        """
+        with self._lock:
+            if self._sessions.get((club, account)) is not session:
+                return False
+            self._sessions[(club, account)] = new_session
+            return True
+
+    def async_login_lock(self, club: str, account: str) -> asyncio.Lock:
+        """
+        Lock to hold while logging in from an asynchronous scraper, so concurrent calls share a single login.
+        """
+        with self._lock:
+            return self._async_login_locks.setdefault((club, account), asyncio.Lock())
+
+
+def is_session_expired(response, login_marker: str) -> bool:
+    """
+    Detect from a requests or httpx response that the session is no longer authenticated:
+    either an explicit expiry status code or a redirection to the login page.
+
+    Parameters:
+        - response : Response of a data request sent with the cached session
+        - login_marker (str): Substring of the login page URL, e.g. '/login'
+    """
+
+    if response.status_code in EXPIRED_STATUS_CODES:
+        return True
+
+    if login_marker in str(response.url):
+        return True
+
+    return login_marker in response.headers.get('location', '')
+
+
+# Process-wide cache shared by every scraper
+session_cache = SessionCache()
@@ -0,0 +1,57 @@
+import base64
+import json
+from datetime import date, datetime, time
+from typing import AsyncIterator
+import schemas
+
+
+# Upper bound of the page size of the paginated reads
+MAX_PAGE_SIZE = 1000
+
+
+def _default(value):
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload) -> bytes:
+    """
+    Serialize a response payload to compact JSON bytes, with dates, times and datetimes in ISO format.
+    """
+    return json.dumps(payload, default= _default, separators= (',', ':'), ensure_ascii= False).encode('utf-8')
+
+
+def header_value(payload) -> str:
+    """
+    JSON of a payload for a response header, ASCII-only since header values are latin-1.
+    """
+    return json.dumps(payload, default= _default, separators= (',', ':'))
+
+
+def encode_page_token(key: dict) -> str:
+    """
+    Opaque token of a page keyset (see crud.page_key), passed back by the client to get the next page.
+    """
+    return base64.urlsafe_b64encode(dumps(key)).decode('ascii')
+
+
+def decode_page_token(token: str) -> dict:
+    """
+    Keyset of a token built by encode_page_token, checked against schemas.PageKey and written back
+    in the stored formats ('YYYY-MM-DD', 'HH:MM:SS'). Raises ValueError if the token is malformed,
+    so a forged token can neither break a stream after its headers are sent nor inject query operators.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return schemas.PageKey.model_validate(key).model_dump(mode= 'json')
+    except Exception as e:
+        raise ValueError(f'Invalid page token {token!r}') from e
+
+
+async def ndjson_lines(documents: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """
+    Encode a stream of documents as newline-delimited JSON, one line per document.
+    """
+    async for document in documents:
+        yield dumps(document) + b'\n'
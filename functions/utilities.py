@@ -1,4 +1,11 @@
 from datetime import datetime
+from pathlib import Path
+from typing import List
+import json
+
+
+CLUBS_PATH = str(Path(__file__).resolve().parent.parent / 'collections' / 'clubs.json')
+
 
 def parse_datetime(dt_str):
     # try full format first
@@ -6,4 +13,22 @@ def parse_datetime(dt_str):
         return datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
     except ValueError:
         # Fallback to no-seconds format
-        return datetime.strptime(dt_str, "%Y-%m-%d %H:%M")
\ No newline at end of file
+        return datetime.strptime(dt_str, "%Y-%m-%d %H:%M")
+
+
+def load_clubs(path: str = CLUBS_PATH) -> List[dict]:
+    """
+    Flatten the {region : {city : [clubs]}} mapping of collections/clubs.json.
+
+    Returns:
+        - clubs (List[dict]) : [{'region' : ..., 'city' : ..., 'club' : ...}, ...]
+    """
+    with open(path, 'r', encoding = 'utf-8') as f:
+        content = json.load(f)
+
+    return [
+        {'region': region, 'city': city, 'club': club}
+        for region, cities in content.items()
+        for city, clubs in cities.items()
+        for club in clubs
+    ]
@@ -0,0 +1,297 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import re
+import time as timer
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from typing import List
+import httpx
+import schemas
+from pymongo import AsyncMongoClient
+from crud import query_free_windows
+from utilities import load_clubs
+
+
+# Token echoed back by the GET verification of the webhook, and secret of the X-Hub-Signature-256 header
+WHATSAPP_VERIFY_TOKEN = os.getenv('WHATSAPP_VERIFY_TOKEN')
+WHATSAPP_APP_SECRET = os.getenv('WHATSAPP_APP_SECRET')
+
+# Credentials of the Cloud API used to send the replies
+WHATSAPP_ACCESS_TOKEN = os.getenv('WHATSAPP_ACCESS_TOKEN')
+WHATSAPP_PHONE_NUMBER_ID = os.getenv('WHATSAPP_PHONE_NUMBER_ID')
+WHATSAPP_API_URL = os.getenv('WHATSAPP_API_URL', 'https://graph.facebook.com/v21.0')
+
+# Outbound client of the replies: 'cloud' (WhatsApp Cloud API) or 'stub' (kept in memory, for local runs and tests)
+WHATSAPP_OUTBOUND = os.getenv('WHATSAPP_OUTBOUND', 'stub')
+
+# Size of the work queue and number of workers answering the messages
+WHATSAPP_QUEUE_SIZE = int(os.getenv('WHATSAPP_QUEUE_SIZE', 1000))
+WHATSAPP_WORKERS = int(os.getenv('WHATSAPP_WORKERS', 4))
+
+# Number of message ids remembered to drop the deliveries retried by WhatsApp
+WHATSAPP_SEEN_IDS = 4096
+
+
+@dataclass
+class IncomingMessage:
+    """
+    Text message received on the webhook.
+
+    Attributes:
+        - message_id (str): WhatsApp id of the message, used to drop retried deliveries
+        - sender (str): Phone number of the sender, the reply is sent to it
+        - text (str): Body of the message
+        - received_at (float): Monotonic time of reception, to measure the time spent in the queue
+    """
+    message_id: str
+    sender: str
+    text: str
+    received_at: float
+
+
+def verify_signature(body: bytes, signature: str | None, app_secret: str) -> bool:
+    """
+    Check the X-Hub-Signature-256 header ('sha256=<hex digest>') of a webhook call against the raw body.
+    """
+    if not signature or not signature.startswith('sha256='):
+        return False
+    expected = hmac.new(app_secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.removeprefix('sha256='))
+
+
+def extract_messages(payload) -> List[IncomingMessage]:
+    """
+    Text messages of a webhook payload. Status updates and non-text messages are ignored.
+
+    Raises:
+        - pydantic.ValidationError (a ValueError) : if the payload does not have the shape of schemas.WhatsAppWebhook
+    """
+    webhook = schemas.WhatsAppWebhook.model_validate(payload)
+    messages = []
+    for entry in webhook.entry:
+        for change in entry.changes:
+            for message in change.value.messages:
+                if message.type != 'text':
+                    continue
+                messages.append(IncomingMessage(message_id= message.id,
+                                                sender= message.sender,
+                                                text= message.text.body if message.text else '',
+                                                received_at= timer.monotonic()))
+    return messages
+
+
+# Parts of a question such as "demain entre 18h et 21h pour 90 min à Saint-Denis"
+DATE_PATTERN = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{4}))?\b")
+TIME_PATTERN = re.compile(r"\b(\d{1,2})\s*(?:h|:)\s*(\d{2})?")
+DURATION_PATTERN = re.compile(r"\b(\d{2,3})\s*(?:min|mn|minutes)\b")
+
+
+def parse_question(text: str, today: date) -> schemas.FreeWindowRead:
+    """
+    Turn a free text question into a free window query: date (aujourd'hui, demain or DD/MM[/YYYY], today by default),
+    time window (the first two times of the message, or from the single time given), minimum duration in minutes
+    and the clubs or cities named in the message.
+    """
+    lowered = text.lower()
+
+    availability_date = today
+    if 'après-demain' in lowered or 'apres-demain' in lowered:
+        availability_date = today + timedelta(days= 2)
+    elif 'demain' in lowered:
+        availability_date = today + timedelta(days= 1)
+    elif (match := DATE_PATTERN.search(lowered)) is not None:
+        day, month, year = match.groups()
+        availability_date = date(int(year) if year else today.year, int(month), int(day))
+        lowered = lowered[:match.start()] + lowered[match.end():]
+
+    min_duration = None
+    if (match := DURATION_PATTERN.search(lowered)) is not None:
+        min_duration = int(match.group(1))
+        lowered = lowered[:match.start()] + lowered[match.end():]
+
+    times = [time(int(hours), int(minutes or 0)) for hours, minutes in TIME_PATTERN.findall(lowered) if int(hours) < 24]
+    time_from = times[0] if times else None
+    time_to = times[1] if len(times) > 1 and times[1] > times[0] else None
+
+    # A named club is more precise than a named city, the city is only used when no club is named
+    clubs = load_clubs()
+    named_clubs = [club['club'] for club in clubs if club['club'].lower() in lowered]
+    named_cities = [] if named_clubs else sorted({club['city'] for club in clubs if club['city'].lower() in lowered})
+
+    return schemas.FreeWindowRead(club= named_clubs or None,
+                                  city= named_cities or None,
+                                  availability_date= availability_date,
+                                  time_from= time_from,
+                                  time_to= time_to,
+                                  min_duration= min_duration)
+
+
+def format_reply(query_filters: schemas.FreeWindowRead, windows: List[dict]) -> str:
+    """
+    Text of the reply: the longest free window of each club, or a message saying there is none.
+    """
+    day = query_filters.availability_date.strftime('%d/%m/%Y')
+    if not windows:
+        return f"Aucun créneau libre trouvé le {day} pour ces critères."
+
+    lines = [f"Créneaux libres le {day} :"]
+    for window in windows:
+        lines.append(f"- {window['club']} ({window['court']}) : {window['available_from'][:5]} - {window['available_to'][:5]}"
+                     f" ({window['available_minutes']} min)")
+    return '\n'.join(lines)
+
+
+class StubOutboundClient:
+    """
+    Outbound client keeping the replies in memory instead of sending them, for local runs and tests.
+    """
+
+    def __init__(self):
+        self.sent: List[dict] = []
+
+    async def send_text(self, recipient: str, body: str):
+        self.sent.append({'to': recipient, 'body': body})
+        print(f'[whatsapp stub] reply to {recipient} : {body}')
+
+    async def close(self):
+        pass
+
+
+class CloudOutboundClient:
+    """
+    Outbound client sending the replies through the WhatsApp Cloud API, with a pooled httpx client.
+    """
+
+    def __init__(self,
+                 access_token: str = WHATSAPP_ACCESS_TOKEN,
+                 phone_number_id: str = WHATSAPP_PHONE_NUMBER_ID,
+                 api_url: str = WHATSAPP_API_URL):
+        self.url = f'{api_url}/{phone_number_id}/messages'
+        self.client = httpx.AsyncClient(headers= {'Authorization': f'Bearer {access_token}'}, timeout= 10)
+
+    async def send_text(self, recipient: str, body: str):
+        response = await self.client.post(self.url, json= {
+            'messaging_product': 'whatsapp',
+            'to': recipient,
+            'type': 'text',
+            'text': {'body': body},
+        })
+        response.raise_for_status()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_outbound_client(kind: str = WHATSAPP_OUTBOUND):
+    """
+    Outbound client named by {kind}: 'cloud' or 'stub'.
+    """
+    if kind == 'cloud':
+        return CloudOutboundClient()
+    if kind == 'stub':
+        return StubOutboundClient()
+    raise ValueError(f"Unknown WhatsApp outbound client '{kind}', expected 'cloud' or 'stub'")
+
+
+class MessageDispatcher:
+    """
+    Bounded work queue between the webhook and a pool of workers.
+    The webhook only enqueues and acknowledges, the workers answer each message from the free windows store
+    and send the reply through the outbound client. When the queue cannot take a whole delivery,
+    the delivery is refused so that WhatsApp retries it later instead of timing out.
+    """
+
+    def __init__(self,
+                 mongodb_client: AsyncMongoClient,
+                 outbound_client,
+                 queue_size: int = WHATSAPP_QUEUE_SIZE,
+                 workers: int = WHATSAPP_WORKERS):
+        self.mongodb_client = mongodb_client
+        self.outbound_client = outbound_client
+        self.queue: asyncio.Queue[IncomingMessage] = asyncio.Queue(maxsize= queue_size)
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._seen_ids: OrderedDict[str, None] = OrderedDict()
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.total_wait_seconds = 0.0
+
+    def submit(self, messages: List[IncomingMessage]) -> bool:
+        """
+        Enqueue the messages of a delivery without waiting. Messages already seen are dropped.
+
+        Returns:
+            - accepted (bool) : False if the queue has no room for the whole delivery
+        """
+        new_messages = [message for message in messages if message.message_id not in self._seen_ids]
+        self.duplicates += len(messages) - len(new_messages)
+
+        if self.queue.maxsize - self.queue.qsize() < len(new_messages):
+            self.rejected += len(new_messages)
+            return False
+
+        for message in new_messages:
+            self.queue.put_nowait(message)
+            self._seen_ids[message.message_id] = None
+            if len(self._seen_ids) > WHATSAPP_SEEN_IDS:
+                self._seen_ids.popitem(last= False)
+        self.accepted += len(new_messages)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    async def answer(self, message: IncomingMessage):
+        today = datetime.now(ZoneInfo("Indian/Reunion")).date()
+        try:
+            query_filters = parse_question(message.text, today)
+        except ValueError:
+            await self.outbound_client.send_text(message.sender, "Je n'ai pas compris la date ou l'horaire demandé.")
+            return
+
+        windows = await query_free_windows(self.mongodb_client, query_filters, longest= True)
+        await self.outbound_client.send_text(message.sender, format_reply(query_filters, windows))
+
+    async def work(self):
+        while True:
+            message = await self.queue.get()
+            self.total_wait_seconds += timer.monotonic() - message.received_at
+            try:
+                await self.answer(message)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f'WhatsApp message {message.message_id} could not be answered: {e!r}')
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions= True)
+        self._tasks = []
+        await self.outbound_client.close()
+
+    def stats(self) -> dict:
+        dequeued = self.processed + self.failed
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'max_depth': self.max_depth,
+            'workers': len(self._tasks),
+            'accepted': self.accepted,
+            'duplicates': self.duplicates,
+            'rejected': self.rejected,
+            'processed': self.processed,
+            'failed': self.failed,
+            'average_wait_seconds': self.total_wait_seconds / dequeued if dequeued else None,
+        }
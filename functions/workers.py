@@ -0,0 +1,79 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TypeVar
+
+
+# Where the parse and validate stage of the scrapers runs:
+#   - 'thread' : a thread pool, cheap to start, the event loop keeps serving requests between two GIL switches
+#   - 'process' : a process pool, for large multi-date refreshes running inside the app, the parsing never
+#     competes with the request handlers for the GIL (the spans recorded by the workers stay in their process)
+#   - 'inline' : on the event loop, as before
+PARSE_POOL = os.getenv('PARSE_POOL', 'thread').lower()
+
+# Number of workers of the pool
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+
+T = TypeVar('T')
+
+
+class ParsePool:
+    """
+    Lazily created executor running the parse stage of the scrapers: it takes the raw payloads downloaded
+    by the fetch stage and returns validated slot batches. The functions sent to a process pool must be
+    defined at module level, and their arguments and results must be picklable.
+    """
+
+    def __init__(self, kind: str = PARSE_POOL, workers: int = PARSE_WORKERS):
+        if kind not in ('thread', 'process', 'inline'):
+            raise ValueError(f"PARSE_POOL must be 'thread', 'process' or 'inline', not {kind!r}")
+        self.kind = kind
+        self.workers = workers
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.running = 0
+
+    def executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.kind == 'process':
+                    # spawn rather than fork: the app process runs threads and an event loop that must not be copied
+                    self._executor = ProcessPoolExecutor(max_workers= self.workers,
+                                                         mp_context= multiprocessing.get_context('spawn'))
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers= self.workers, thread_name_prefix= 'parse')
+            return self._executor
+
+    async def run(self, function: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Run {function}(*args, **kwargs) on the pool and wait for its result without blocking the event loop.
+        """
+        self.submitted += 1
+        if self.kind == 'inline':
+            return function(*args, **kwargs)
+
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor(), partial(function, *args, **kwargs))
+        finally:
+            self.running -= 1
+
+    def shutdown(self):
+        """
+        Stop the workers, e.g. when the app stops. The pool is created again on its next use.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait= False, cancel_futures= True)
+
+    def stats(self) -> dict:
+        return {'kind': self.kind, 'workers': self.workers, 'submitted': self.submitted, 'running': self.running}
+
+
+# Process-wide pool shared by every scraper
+parse_pool = ParsePool()
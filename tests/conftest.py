@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules of functions/ import each other by their flat names (see functions/__init__.py)
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'functions'))
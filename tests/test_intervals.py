@@ -0,0 +1,24 @@
+import pytest
+from intervals import merge_intervals
+
+
+@pytest.mark.parametrize('intervals, merged', [
+    ([], []),
+    ([(480, 570)], [(480, 570)]),
+    # Unsorted and disjoint
+    ([(600, 660), (480, 540)], [(480, 540), (600, 660)]),
+    # Overlapping
+    ([(480, 570), (540, 630)], [(480, 630)]),
+    # Touching: a slot ends when the next one starts
+    ([(480, 540), (540, 600)], [(480, 600)]),
+    # Contained and repeated
+    ([(480, 660), (510, 540), (480, 660)], [(480, 660)]),
+    # A chain of overlaps merged into a single window
+    ([(600, 690), (480, 570), (540, 630), (720, 780)], [(480, 690), (720, 780)]),
+])
+def test_merge_intervals(intervals, merged):
+    assert merge_intervals(intervals) == merged
+
+
+def test_merge_intervals_accepts_any_iterable():
+    assert merge_intervals(iter([(540, 600), (480, 540)])) == [(480, 600)]
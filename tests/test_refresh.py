@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import pytest
+import schemas
+import refresh
+
+
+@pytest.fixture
+def coordinator(monkeypatch):
+    """
+    Fresh coordinator recording the refreshes it is asked to start instead of scraping.
+    """
+    coordinator = refresh.RefreshCoordinator()
+    coordinator.requested = []
+    monkeypatch.setattr(coordinator, 'refresh', lambda client, club, availability_date: coordinator.requested.append((club, availability_date)))
+    monkeypatch.setattr(refresh, 'refresh_coordinator', coordinator)
+    return coordinator
+
+
+def now():
+    return datetime.now(ZoneInfo("Indian/Reunion"))
+
+
+def test_stale_club_is_refreshed(coordinator):
+    today = now().date()
+    query_filters = schemas.AvailabilityRead(club= ['TCD'], availability_date= today)
+
+    freshness = refresh.revalidate(None, query_filters, {'TCD': now() - timedelta(minutes= 45)}, stale_after_minutes= 30)
+
+    assert freshness['TCD']['refreshing'] is True
+    assert coordinator.requested == [('TCD', today)]
+
+
+def test_fresh_club_is_not_refreshed(coordinator):
+    query_filters = schemas.AvailabilityRead(club= ['TCD'], availability_date= now().date())
+
+    freshness = refresh.revalidate(None, query_filters, {'TCD': now() - timedelta(minutes= 5)}, stale_after_minutes= 30)
+
+    assert freshness['TCD']['refreshing'] is False
+    assert 240 < freshness['TCD']['age_seconds'] < 360
+    assert coordinator.requested == []
+
+
+def test_never_scraped_club_is_refreshed(coordinator):
+    query_filters = schemas.AvailabilityRead(club= ['Oasis'], availability_date= now().date())
+
+    freshness = refresh.revalidate(None, query_filters, {})
+
+    assert freshness['Oasis'] == {'scraped_at': None, 'age_seconds': None, 'refreshing': True}
+
+
+def test_last_refresh_counts_as_a_scrape(coordinator):
+    today = now().date()
+    coordinator.last_refreshed[('TCD', today)] = now()
+    query_filters = schemas.AvailabilityRead(club= ['TCD'], availability_date= today)
+
+    freshness = refresh.revalidate(None, query_filters, {'TCD': now() - timedelta(hours= 3)}, stale_after_minutes= 30)
+
+    assert freshness['TCD']['refreshing'] is False
+
+
+@pytest.mark.parametrize('days_ahead', [-1, refresh.PREWARM_HORIZON_DAYS, refresh.PREWARM_HORIZON_DAYS + 30])
+def test_dates_outside_the_horizon_are_not_refreshed(coordinator, days_ahead):
+    query_filters = schemas.AvailabilityRead(club= ['TCD'], availability_date= now().date() + timedelta(days= days_ahead))
+
+    freshness = refresh.revalidate(None, query_filters, {})
+
+    assert freshness['TCD']['refreshing'] is False
+    assert coordinator.requested == []
+
+
+def test_clubs_without_scraper_are_left_out(coordinator):
+    query_filters = schemas.AvailabilityRead(club= ['Hangar', 'TCD'], availability_date= now().date())
+
+    assert list(refresh.revalidate(None, query_filters, {})) == ['TCD']
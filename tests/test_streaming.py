@@ -0,0 +1,37 @@
+import base64
+import json
+from datetime import date, time
+import pytest
+from streaming import encode_page_token, decode_page_token
+
+
+KEY = {'availability_date': '2026-10-18', 'availability_time': '18:30:00', 'club': 'TCD', 'court': 'Padel 2',
+       'availability_duration': 90}
+
+
+def token_of(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+
+def test_round_trip():
+    assert decode_page_token(encode_page_token(KEY)) == KEY
+
+
+def test_dates_and_times_are_written_back_in_the_stored_formats():
+    key = {**KEY, 'availability_date': date(2026, 10, 18), 'availability_time': time(18, 30)}
+
+    assert decode_page_token(encode_page_token(key)) == KEY
+
+
+@pytest.mark.parametrize('token', [
+    'not a token',
+    token_of([1, 2, 3]),
+    token_of({**KEY, 'club': {'$ne': None}}),
+    token_of({**KEY, 'availability_duration': '90'}),
+    token_of({**KEY, 'availability_date': '18/10/2026'}),
+    token_of({**KEY, 'price': 10}),
+    token_of({field: value for field, value in KEY.items() if field != 'court'}),
+])
+def test_malformed_tokens_are_refused(token):
+    with pytest.raises(ValueError):
+        decode_page_token(token)
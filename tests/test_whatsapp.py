@@ -0,0 +1,68 @@
+import hashlib
+import hmac
+from datetime import date, time
+import pytest
+from whatsapp import verify_signature, parse_question
+
+
+SECRET = 'app-secret'
+BODY = b'{"object": "whatsapp_business_account", "entry": []}'
+TODAY = date(2026, 10, 18)
+
+
+def signature_of(body: bytes, secret: str = SECRET) -> str:
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def test_valid_signature():
+    assert verify_signature(BODY, signature_of(BODY), SECRET)
+
+
+@pytest.mark.parametrize('signature', [
+    None,
+    '',
+    signature_of(BODY).removeprefix('sha256='),
+    'sha1=' + hmac.new(SECRET.encode('utf-8'), BODY, hashlib.sha1).hexdigest(),
+    signature_of(BODY, 'other-secret'),
+    signature_of(BODY + b' '),
+])
+def test_invalid_signatures_are_refused(signature):
+    assert not verify_signature(BODY, signature, SECRET)
+
+
+def test_question_with_date_time_window_duration_and_city():
+    query_filters = parse_question('Demain entre 18h et 21h pour 90 min à Saint-Denis ?', TODAY)
+
+    assert query_filters.availability_date == date(2026, 10, 19)
+    assert (query_filters.time_from, query_filters.time_to) == (time(18, 0), time(21, 0))
+    assert query_filters.min_duration == 90
+    assert query_filters.city == ['Saint-Denis']
+    assert query_filters.club is None
+
+
+def test_question_with_explicit_date_and_club():
+    query_filters = parse_question('TCD le 25/12 à 19h30', TODAY)
+
+    assert query_filters.availability_date == date(2026, 12, 25)
+    assert (query_filters.time_from, query_filters.time_to) == (time(19, 30), None)
+    assert query_filters.club == ['TCD']
+    assert query_filters.city is None
+
+
+def test_named_club_takes_precedence_over_its_city():
+    query_filters = parse_question('Champ-Fleuri à Saint-Denis', TODAY)
+
+    assert query_filters.club == ['Champ-Fleuri']
+    assert query_filters.city is None
+
+
+def test_question_without_details_searches_today_everywhere():
+    query_filters = parse_question('Des terrains libres ?', TODAY)
+
+    assert query_filters.availability_date == TODAY
+    assert (query_filters.time_from, query_filters.time_to, query_filters.min_duration) == (None, None, None)
+    assert (query_filters.club, query_filters.city) == (None, None)
+
+
+def test_day_after_tomorrow_is_not_read_as_tomorrow():
+    assert parse_question('après-demain 20h', TODAY).availability_date == date(2026, 10, 20)